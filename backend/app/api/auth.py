@@ -1,16 +1,19 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from jose import JWTError
 from sqlalchemy.orm import Session
 
-from app.api.deps import get_db, get_current_user
+from app.api.deps import UserPrincipal, get_current_user, get_db
 from app.core.security import (
     create_access_token,
     create_refresh_token,
     decode_token,
-    get_password_hash,
+    hash_password,
     is_refresh_token,
-    verify_password,
+    verify_and_update_password,
 )
 from app.models.user import User
 from app.schemas.schemas import Token, TokenRefresh, UserCreate, UserOut
@@ -18,26 +21,51 @@ from app.schemas.schemas import Token, TokenRefresh, UserCreate, UserOut
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
-@router.post("/register", response_model=UserOut)
-def register(user_in: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user_in.email).first()
-    if existing:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
-    user = User(email=user_in.email, hashed_password=get_password_hash(user_in.password))
+# register/login are async so a request waiting on bcrypt holds no threadpool
+# slot; their (blocking) database work still goes through the threadpool.
+def _user_by_email(db: Session, email: str) -> Optional[User]:
+    return db.query(User).filter(User.email == email).first()
+
+
+def _create_user(db: Session, email: str, hashed_password: str) -> User:
+    user = User(email=email, hashed_password=hashed_password)
     db.add(user)
     db.commit()
     db.refresh(user)
     return user
 
 
+def _store_password_hash(db: Session, user: User, hashed_password: str) -> None:
+    user.hashed_password = hashed_password
+    db.commit()
+
+
+@router.post("/register", response_model=UserOut)
+async def register(user_in: UserCreate, db: Session = Depends(get_db)):
+    existing = await run_in_threadpool(_user_by_email, db, user_in.email)
+    if existing:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
+    hashed_password = await hash_password(user_in.password)
+    return await run_in_threadpool(_create_user, db, user_in.email, hashed_password)
+
+
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_user_by_email, db, form_data.username)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    verified, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    if user.is_active is False:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Inactive user")
+    # Read before the commit below expires the instance.
+    subject = str(user.id)
+    if new_hash:
+        await run_in_threadpool(_store_password_hash, db, user, new_hash)
     return Token(
-        access_token=create_access_token(str(user.id)),
-        refresh_token=create_refresh_token(str(user.id)),
+        access_token=create_access_token(subject),
+        refresh_token=create_refresh_token(subject),
     )
 
 
@@ -53,6 +81,8 @@ def refresh(payload: TokenRefresh, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == int(user_id)).first() if user_id else None
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    if user.is_active is False:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Inactive user")
     return Token(
         access_token=create_access_token(str(user.id)),
         refresh_token=create_refresh_token(str(user.id)),
@@ -60,5 +90,5 @@ def refresh(payload: TokenRefresh, db: Session = Depends(get_db)):
 
 
 @router.get("/me", response_model=UserOut)
-def read_me(current_user: User = Depends(get_current_user)):
+def read_me(current_user: UserPrincipal = Depends(get_current_user)):
     return current_user
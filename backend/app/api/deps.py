@@ -1,8 +1,17 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.security import decode_token, is_access_token
 from app.db.session import SessionLocal
 from app.models.user import User
@@ -11,6 +20,85 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 oauth2_optional = OAuth2PasswordBearer(tokenUrl="/api/auth/login", auto_error=False)
 
 
+@dataclass(frozen=True)
+class UserPrincipal:
+    """The authenticated user as endpoints see it, detached from any session."""
+
+    id: int
+    email: str
+    is_active: bool
+    created_at: Optional[datetime]
+
+
+class PrincipalCache:
+    """LRU of verified access token -> principal.
+
+    An entry lives until the token's own ``exp`` or ``auth_cache_seconds``,
+    whichever is sooner, so a hit skips both ``jwt.decode`` and the users
+    query. Deactivating or deleting a user drops their entries in this
+    process; other workers see the change once the TTL runs out.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[UserPrincipal, float]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+
+    def get(self, token: str) -> Optional[UserPrincipal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return principal
+
+    def put(self, token: str, principal: UserPrincipal, token_expires_at: float) -> None:
+        if self._max_entries <= 0 or self._ttl_seconds <= 0:
+            return
+        expires_at = min(token_expires_at, time.time() + self._ttl_seconds)
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (principal, expires_at)
+            self._tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self._max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0].id]
+
+
+principal_cache = PrincipalCache(settings.auth_cache_size, settings.auth_cache_seconds)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_on_update(_mapper, _connection, target: User) -> None:
+    if inspect(target).attrs.is_active.history.has_changes():
+        principal_cache.invalidate_user(target.id)
+
+
+@event.listens_for(User, "after_delete")
+def _invalidate_on_delete(_mapper, _connection, target: User) -> None:
+    principal_cache.invalidate_user(target.id)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -19,7 +107,10 @@ def get_db():
         db.close()
 
 
-def get_user_from_token(token: str, db: Session) -> User:
+def get_user_from_token(token: str, db: Session) -> UserPrincipal:
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = decode_token(token)
     except JWTError:
@@ -32,16 +123,20 @@ def get_user_from_token(token: str, db: Session) -> User:
     user = db.query(User).filter(User.id == int(user_id)).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    if user.is_active is False:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Inactive user")
+    principal = UserPrincipal(id=user.id, email=user.email, is_active=True, created_at=user.created_at)
+    principal_cache.put(token, principal, float(payload["exp"]))
+    return principal
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> UserPrincipal:
     return get_user_from_token(token, db)
 
 
 def get_current_user_optional(
     token: str | None = Depends(oauth2_optional), db: Session = Depends(get_db)
-) -> User | None:
+) -> UserPrincipal | None:
     if not token:
         return None
     return get_user_from_token(token, db)
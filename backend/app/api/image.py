@@ -1,16 +1,37 @@
+import os
+from concurrent.futures import Future
+from functools import partial
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Request, UploadFile, status
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, File, HTTPException, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, joinedload, load_only
 
-from app.api.deps import get_current_user, get_current_user_optional, get_db, get_user_from_token
+from app.api.deps import UserPrincipal, get_current_user, get_current_user_optional, get_db, get_user_from_token
+from app.api.pagination import NEXT_CURSOR_HEADER, PageParams, load_columns, page_response, paginate, project
+from app.api.responses import file_response
 from app.models.image import Image
 from app.models.image_conversion import ImageConversion
-from app.models.user import User
-from app.schemas.schemas import ImageConversionCreate, ImageConversionOut, ImageHistoryItem, ImageOut
-from app.services.image import convert_image, get_image_info
+from app.core.config import settings
+from app.schemas.schemas import (
+    ImageBatchConversionCreate,
+    ImageConversionCreate,
+    ImageConversionOut,
+    ImageHistoryItem,
+    ImageOut,
+)
+from app.services.events import broker, stream_events
+from app.services.image import (
+    convert_image,
+    convert_image_derivatives,
+    generate_image_previews,
+    parse_resolution,
+    read_image_header,
+    submit_background_image_job,
+    submit_image_job,
+)
 from app.services.rate_limit import enforce_rate_limit
 from app.services.storage import IMAGE_ORIGINALS_DIR, save_upload_file_to_dir, safe_filename
 from app.db.session import SessionLocal
@@ -21,7 +42,7 @@ ALLOWED_IMAGE_FORMATS = {"jpg", "jpeg", "png", "webp"}
 ALLOWED_IMAGE_MIME = {"image/jpeg", "image/png", "image/webp"}
 
 
-def _resolve_user(token: Optional[str], db: Session, header_user: Optional[User]) -> User:
+def _resolve_user(token: Optional[str], db: Session, header_user: Optional[UserPrincipal]) -> UserPrincipal:
     if token:
         return get_user_from_token(token, db)
     if header_user:
@@ -37,118 +58,269 @@ def _validate_upload(file: UploadFile) -> None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported image format")
 
 
+def _store_image_previews(image_id: int, future: Future) -> None:
+    # Runs as a done-callback on the pool's result thread, so no request
+    # thread waits behind the niced background queue.
+    if future.cancelled() or future.exception() is not None:
+        return
+    previews = future.result()
+    db = SessionLocal()
+    try:
+        image = db.query(Image).filter(Image.id == image_id).first()
+        if image:
+            image.thumbnail_path = previews["thumbnail"]
+            image.placeholder = previews["placeholder"]
+            db.commit()
+    finally:
+        db.close()
+
+
 @router.post("/upload", response_model=ImageOut)
 async def upload_image(
     request: Request,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
-    enforce_rate_limit(request)
+    await run_in_threadpool(enforce_rate_limit, request, current_user.id)
     _validate_upload(file)
     original_path, size = await save_upload_file_to_dir(file, IMAGE_ORIGINALS_DIR)
-    resolution = get_image_info(original_path)
+    try:
+        header = await run_in_threadpool(read_image_header, original_path)
+    except Exception:
+        os.remove(original_path)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unreadable image")
+    if header["width"] * header["height"] > settings.image_max_pixels:
+        os.remove(original_path)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Image exceeds the pixel limit")
     image = Image(
         user_id=current_user.id,
         original_filename=file.filename,
         original_format=Path(file.filename).suffix.lower().lstrip("."),
-        original_resolution=resolution,
+        original_resolution=f"{header['width']}x{header['height']}",
         file_size=size,
         original_path=original_path,
+        **header,
     )
     db.add(image)
     db.commit()
     db.refresh(image)
+    submit_background_image_job(generate_image_previews, original_path, image.id).add_done_callback(
+        partial(_store_image_previews, image.id)
+    )
     return image
 
 
-def _conversion_task(conversion_id: int, payload: ImageConversionCreate) -> None:
+def _progress_event(conversion: ImageConversion) -> dict:
+    return {
+        "id": conversion.id,
+        "status": conversion.status,
+        "progress": conversion.progress,
+        "download_url": conversion.download_url,
+        "error_message": conversion.error_message,
+    }
+
+
+def _commit_and_publish(db: Session, conversion: ImageConversion) -> None:
+    db.commit()
+    broker.publish(f"image:{conversion.id}", _progress_event(conversion))
+
+
+def _finish_conversion(conversion_id: int, future: Future) -> None:
+    # Done-callback on the pool's result thread, like _store_image_previews:
+    # no request thread waits while the job is queued or running.
+    try:
+        (output_path, error), peak_rss_mb = future.result()
+    except Exception as exc:
+        output_path, error, peak_rss_mb = "", str(exc) or type(exc).__name__, None
     db = SessionLocal()
     try:
         conversion = db.query(ImageConversion).filter(ImageConversion.id == conversion_id).first()
-        image = db.query(Image).filter(Image.id == payload.image_id).first()
-        if not conversion or not image:
-            return
-        conversion.status = "processing"
-        db.commit()
-        output_path, error = convert_image(
-            image.original_path,
-            conversion_id,
-            payload.target_format,
-            payload.target_resolution,
-            payload.quality,
-        )
-        if error:
-            conversion.status = "failed"
-            conversion.error_message = error
-            db.commit()
-            return
+        if conversion:
+            _complete(db, conversion, output_path, error, peak_rss_mb)
+    finally:
+        db.close()
+
+
+def _complete(
+    db: Session,
+    conversion: ImageConversion,
+    output_path: str,
+    error: Optional[str],
+    peak_rss_mb: Optional[float] = None,
+) -> None:
+    conversion.peak_rss_mb = peak_rss_mb
+    if error:
+        conversion.status = "failed"
+        conversion.error_message = error
+    else:
         conversion.output_path = output_path
-        conversion.download_url = f"/api/image/download/{image.id}?conversion_id={conversion_id}"
+        conversion.download_url = f"/api/image/download/{conversion.image_id}?conversion_id={conversion.id}"
         conversion.status = "completed"
         conversion.progress = 100
-        db.commit()
+    _commit_and_publish(db, conversion)
+
+
+def _finish_batch(conversion_ids: List[int], future: Future) -> None:
+    # One decode feeds every derivative, so they share the job's peak.
+    try:
+        results, peak_rss_mb = future.result()
     except Exception as exc:
-        conversion = db.query(ImageConversion).filter(ImageConversion.id == conversion_id).first()
-        if conversion:
-            conversion.status = "failed"
-            conversion.error_message = str(exc)
-            db.commit()
+        results, peak_rss_mb = [("", str(exc) or type(exc).__name__)] * len(conversion_ids), None
+    db = SessionLocal()
+    try:
+        conversions = {
+            conversion.id: conversion
+            for conversion in db.query(ImageConversion).filter(ImageConversion.id.in_(conversion_ids)).all()
+        }
+        for conversion_id, (output_path, error) in zip(conversion_ids, results):
+            if conversion_id in conversions:
+                _complete(db, conversions[conversion_id], output_path, error, peak_rss_mb)
     finally:
         db.close()
 
 
+def _validate_target(target_format: str, target_resolution: Optional[str]) -> None:
+    if target_format not in ALLOWED_IMAGE_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported target format")
+    try:
+        size = parse_resolution(target_resolution)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid target resolution")
+    if size and size[0] * size[1] > settings.image_max_pixels:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Target resolution exceeds the pixel limit")
+
+
 @router.post("/convert", response_model=ImageConversionOut)
 def convert_image_api(
     payload: ImageConversionCreate,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
     image = db.query(Image).filter(Image.id == payload.image_id, Image.user_id == current_user.id).first()
     if not image:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
-    if payload.target_format not in ALLOWED_IMAGE_FORMATS:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported target format")
+    _validate_target(payload.target_format, payload.target_resolution)
     conversion = ImageConversion(
         image_id=image.id,
         user_id=current_user.id,
         target_format=payload.target_format,
         target_resolution=payload.target_resolution,
         quality=payload.quality,
-        status="queued",
+        status="processing",
         progress=0,
     )
     db.add(conversion)
     db.commit()
     db.refresh(conversion)
-    background_tasks.add_task(_conversion_task, conversion.id, payload)
+    try:
+        future = submit_image_job(
+            convert_image,
+            image.original_path,
+            conversion.id,
+            payload.target_format,
+            payload.target_resolution,
+            payload.quality,
+        )
+    except Exception as exc:
+        _complete(db, conversion, "", str(exc))
+        return conversion
+    future.add_done_callback(partial(_finish_conversion, conversion.id))
     return conversion
 
 
+@router.post("/convert/batch", response_model=List[ImageConversionOut])
+def convert_image_batch(
+    payload: ImageBatchConversionCreate,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    """Create one conversion per derivative, all produced from a single decode."""
+    image = db.query(Image).filter(Image.id == payload.image_id, Image.user_id == current_user.id).first()
+    if not image:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    if not payload.outputs:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No outputs given")
+    if len(payload.outputs) > settings.batch_max_conversions:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Batch too large")
+    for output in payload.outputs:
+        _validate_target(output.target_format, output.target_resolution)
+    conversions = [
+        ImageConversion(
+            image_id=image.id,
+            user_id=current_user.id,
+            target_format=output.target_format,
+            target_resolution=output.target_resolution,
+            quality=output.quality,
+            status="processing",
+            progress=0,
+        )
+        for output in payload.outputs
+    ]
+    db.add_all(conversions)
+    db.commit()
+    for conversion in conversions:
+        db.refresh(conversion)
+    try:
+        future = submit_image_job(
+            convert_image_derivatives,
+            image.original_path,
+            [
+                {
+                    "conversion_id": conversion.id,
+                    "target_format": conversion.target_format,
+                    "target_resolution": conversion.target_resolution,
+                    "quality": conversion.quality,
+                }
+                for conversion in conversions
+            ],
+        )
+    except Exception as exc:
+        for conversion in conversions:
+            _complete(db, conversion, "", str(exc))
+        return conversions
+    future.add_done_callback(partial(_finish_batch, [conversion.id for conversion in conversions]))
+    return conversions
+
+
 @router.get("/list", response_model=List[ImageOut])
-def list_images(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return (
-        db.query(Image)
-        .filter(Image.user_id == current_user.id)
-        .order_by(Image.created_at.desc())
-        .all()
-    )
+def list_images(
+    response: Response,
+    page: PageParams = Depends(),
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    query = db.query(Image).filter(Image.user_id == current_user.id)
+    if page.fields:
+        query = query.options(load_only(*load_columns(Image, ImageOut, page.fields)))
+    images, next_cursor = paginate(query, Image, page)
+    if page.fields:
+        return page_response(project(images, page.fields, ImageOut), next_cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return images
 
 
 @router.get("/history", response_model=List[ImageHistoryItem])
-def history(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    conversions = (
+def history(
+    response: Response,
+    page: PageParams = Depends(),
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    query = (
         db.query(ImageConversion)
+        .options(joinedload(ImageConversion.image, innerjoin=True))
         .filter(ImageConversion.user_id == current_user.id)
-        .order_by(ImageConversion.created_at.desc())
-        .all()
     )
-    items = []
-    for conversion in conversions:
-        image = conversion.image
-        if image:
-            items.append({"image": image, "conversion": conversion})
+    conversions, next_cursor = paginate(query, ImageConversion, page)
+    items = [{"image": conversion.image, "conversion": conversion} for conversion in conversions]
+    if page.fields:
+        return page_response(
+            project(items, page.fields, {"image": ImageOut, "conversion": ImageConversionOut}), next_cursor
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return items
 
 
@@ -156,7 +328,7 @@ def history(db: Session = Depends(get_db), current_user: User = Depends(get_curr
 def conversion_status(
     conversion_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
     conversion = (
         db.query(ImageConversion)
@@ -168,13 +340,50 @@ def conversion_status(
     return conversion
 
 
+@router.get("/status/{conversion_id}/stream")
+async def conversion_status_stream(
+    conversion_id: int,
+    token: Optional[str] = None,
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
+):
+    def load() -> Optional[dict]:
+        db = SessionLocal()
+        try:
+            user = _resolve_user(token, db, current_user)
+            conversion = (
+                db.query(ImageConversion)
+                .filter(ImageConversion.id == conversion_id, ImageConversion.user_id == user.id)
+                .first()
+            )
+            return _progress_event(conversion) if conversion else None
+        finally:
+            db.close()
+
+    topic = f"image:{conversion_id}"
+    queue = broker.subscribe(topic)
+    try:
+        initial = await run_in_threadpool(load)
+    except Exception:
+        broker.unsubscribe(topic, queue)
+        raise
+    if initial is None:
+        broker.unsubscribe(topic, queue)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversion not found")
+    return StreamingResponse(
+        stream_events(topic, queue, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/preview/{image_id}")
 def preview_image(
+    request: Request,
     image_id: int,
     conversion_id: Optional[int] = None,
     token: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional),
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
 ):
     current_user = _resolve_user(token, db, current_user)
     image = db.query(Image).filter(Image.id == image_id, Image.user_id == current_user.id).first()
@@ -188,17 +397,33 @@ def preview_image(
         )
         if not conversion or not conversion.output_path:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversion not ready")
-        return FileResponse(conversion.output_path, filename=safe_filename(conversion.output_path))
-    return FileResponse(image.original_path, filename=image.original_filename)
+        return file_response(request, conversion.output_path, safe_filename(conversion.output_path))
+    return file_response(request, image.original_path, image.original_filename)
+
+
+@router.get("/thumbnail/{image_id}")
+def thumbnail(
+    request: Request,
+    image_id: int,
+    token: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
+):
+    current_user = _resolve_user(token, db, current_user)
+    image = db.query(Image).filter(Image.id == image_id, Image.user_id == current_user.id).first()
+    if not image or not image.thumbnail_path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thumbnail not ready")
+    return file_response(request, image.thumbnail_path, safe_filename(image.thumbnail_path))
 
 
 @router.get("/download/{image_id}")
 def download_image(
+    request: Request,
     image_id: int,
     conversion_id: Optional[int] = None,
     token: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional),
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
 ):
     current_user = _resolve_user(token, db, current_user)
     image = db.query(Image).filter(Image.id == image_id, Image.user_id == current_user.id).first()
@@ -212,5 +437,5 @@ def download_image(
         )
         if not conversion or not conversion.output_path:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversion not ready")
-        return FileResponse(conversion.output_path, filename=safe_filename(conversion.output_path))
-    return FileResponse(image.original_path, filename=image.original_filename)
+        return file_response(request, conversion.output_path, safe_filename(conversion.output_path))
+    return file_response(request, image.original_path, image.original_filename)
@@ -0,0 +1,116 @@
+import base64
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+from fastapi import HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import String, and_, or_, type_coerce
+from sqlalchemy.orm import Query as OrmQuery
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class PageParams:
+    """Query parameters shared by the history and list endpoints.
+
+    Without ``limit`` or ``cursor`` every row is returned, as before paging
+    existed; a ``cursor`` alone pages by ``DEFAULT_PAGE_SIZE``. ``cursor`` is
+    the ``X-Next-Cursor`` header of the previous page; ``fields`` is a
+    comma-separated projection, with ``video.``/``image.``/``conversion.``
+    prefixes on history endpoints.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = Query(None),
+        fields: Optional[str] = Query(None),
+    ) -> None:
+        self.limit = limit or (DEFAULT_PAGE_SIZE if cursor else None)
+        self.cursor = cursor
+        self.fields = [field.strip() for field in fields.split(",") if field.strip()] if fields else []
+
+
+def _encode_cursor(created_at: str, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{row_id}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return created_at, int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def paginate(query: OrmQuery, model: Any, page: PageParams) -> Tuple[List[Any], Optional[str]]:
+    """Newest-first keyset page over ``(created_at, id)``.
+
+    ``query`` should already be filtered on ``user_id`` so the composite
+    ``(user_id, created_at, id)`` index serves both the filter and the order.
+    ``created_at`` is compared as stored text: server-side ``now()`` values
+    have no fractional seconds, which a bound ``datetime`` would add, breaking
+    equality on ties.
+    """
+    created_at = type_coerce(model.created_at, String)
+    if page.cursor:
+        last_created_at, last_id = _decode_cursor(page.cursor)
+        query = query.filter(
+            or_(created_at < last_created_at, and_(created_at == last_created_at, model.id < last_id))
+        )
+    query = query.add_columns(created_at).order_by(model.created_at.desc(), model.id.desc())
+    if page.limit is None:
+        return [row[0] for row in query.all()], None
+    rows = query.limit(page.limit + 1).all()
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[: page.limit]
+        next_cursor = _encode_cursor(rows[-1][1], rows[-1][0].id)
+    return [row[0] for row in rows], next_cursor
+
+
+def _field_names(schema: Type[BaseModel]) -> Sequence[str]:
+    return list(getattr(schema, "model_fields", None) or schema.__fields__)
+
+
+def load_columns(model: Any, schema: Type[BaseModel], fields: List[str]) -> List[Any]:
+    """Columns to pass to ``load_only`` for a flat projection (always with the keyset columns)."""
+    names = {"id", "created_at", *fields}
+    return [getattr(model, name) for name in _field_names(schema) if name in names and hasattr(model, name)]
+
+
+def project(
+    items: List[Any],
+    fields: List[str],
+    schema: Union[Type[BaseModel], Dict[str, Type[BaseModel]]],
+) -> List[Dict[str, Any]]:
+    """Pick ``fields`` from ORM rows, or from dicts of rows when ``schema`` maps keys to schemas.
+
+    Only the requested attributes are read, so columns left out by
+    ``load_only`` are never lazy-loaded.
+    """
+    for field in fields:
+        prefix, _, name = field.rpartition(".")
+        owner = schema.get(prefix) if isinstance(schema, dict) else (None if prefix else schema)
+        if owner is None or name not in _field_names(owner):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown field: {field}")
+    projected = []
+    for item in items:
+        row: Dict[str, Any] = {}
+        for field in fields:
+            prefix, _, name = field.rpartition(".")
+            if prefix:
+                row.setdefault(prefix, {})[name] = getattr(item[prefix], name)
+            else:
+                row[name] = getattr(item, name)
+        projected.append(row)
+    return projected
+
+
+def page_response(items: List[Any], next_cursor: Optional[str]) -> JSONResponse:
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    return JSONResponse(jsonable_encoder(items), headers=headers)
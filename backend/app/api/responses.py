@@ -0,0 +1,137 @@
+import mimetypes
+import os
+import re
+from typing import Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+IMMUTABLE_CACHE = "private, max-age=31536000, immutable"
+REVALIDATE_CACHE = "private, no-cache"
+# Starlette renamed the 416 constant; the number is stable across versions.
+RANGE_NOT_SATISFIABLE = 416
+
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_STREAM_BLOCK = 256 * 1024
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    # Inode, size and mtime identify a file version without reading it.
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Return an inclusive (start, end) for a single byte range, or None to send the whole file."""
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        # Multi-range and unknown units are allowed to fall back to 200.
+        return None
+    start_text, end_text = match.groups()
+    if not start_text and not end_text:
+        return None
+    if not start_text:
+        length = int(end_text)
+        if length == 0:
+            raise HTTPException(
+                status_code=RANGE_NOT_SATISFIABLE,
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+        return max(size - length, 0), size - 1
+    start = int(start_text)
+    end = min(int(end_text), size - 1) if end_text else size - 1
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def _read_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    remaining = end - start + 1
+    with open(path, "rb") as source:
+        source.seek(start)
+        while remaining > 0:
+            block = source.read(min(_STREAM_BLOCK, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def file_response(
+    request: Request,
+    path: Optional[str],
+    filename: str,
+    cache_control: str = IMMUTABLE_CACHE,
+) -> Response:
+    """Serve a stored file with ETag/304 and single-range 206 support.
+
+    Players seek with Range requests and list views re-request thumbnails, so
+    both should cost a few kilobytes (or nothing) rather than the full file.
+    """
+    if not path or not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    etag = file_etag(stat_result)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and size > 0 and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range:
+            start, end = byte_range
+            media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            headers.update(
+                {
+                    "Content-Range": f"bytes {start}-{end}/{size}",
+                    "Content-Length": str(end - start + 1),
+                    "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}",
+                }
+            )
+            return StreamingResponse(
+                _read_range(path, start, end),
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type=media_type,
+                headers=headers,
+            )
+
+    return FileResponse(path, filename=filename, headers=headers, stat_result=stat_result)
+
+
+def playlist_response(request: Request, path: str, token: Optional[str] = None) -> Response:
+    """Serve an HLS playlist, carrying ``token`` over to every URI it lists.
+
+    Native players fetch variant playlists and segments without our
+    Authorization header, so a query-string token has to be propagated.
+    """
+    if not token:
+        return file_response(request, path, os.path.basename(path), REVALIDATE_CACHE)
+    suffix = f"?token={quote(token)}"
+    with open(path, "r", encoding="utf-8") as playlist:
+        lines = [
+            line if not line.strip() or line.startswith("#") else f"{line.rstrip()}{suffix}\n"
+            for line in playlist
+        ]
+    return Response(
+        "".join(lines),
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": REVALIDATE_CACHE},
+    )
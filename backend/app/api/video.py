@@ -1,33 +1,73 @@
+import hashlib
 import os
+import uuid
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import APIRouter, BackgroundTasks, Depends, File, Form, HTTPException, Request, UploadFile, status
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Form, HTTPException, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, joinedload, load_only
 
-from app.api.deps import get_current_user, get_current_user_optional, get_db, get_user_from_token
+from app.api.deps import UserPrincipal, get_current_user, get_current_user_optional, get_db, get_user_from_token
+from app.api.pagination import NEXT_CURSOR_HEADER, PageParams, load_columns, page_response, paginate, project
+from app.api.responses import REVALIDATE_CACHE, file_response, playlist_response
 from app.core.config import settings
 from app.models.conversion import Conversion
-from app.models.user import User
 from app.models.video import Video
-from app.schemas.schemas import ConversionCreate, ConversionOut, HistoryItem, VideoOut
-from app.services.conversion import run_conversion_with_progress
-from app.services.ffmpeg import ensure_ffmpeg_tools, generate_preview_clip, generate_thumbnail, get_video_info
+from app.schemas.schemas import (
+    BatchConversionCreate,
+    BatchConversionOut,
+    ConversionCreate,
+    ConversionOut,
+    HistoryItem,
+    VideoOut,
+)
+from app.services import cache
+from app.services.conversion import (
+    run_conversion_with_progress,
+    run_multi_output_conversion,
+    run_two_pass_conversion,
+)
+from app.services.events import broker, stream_events
+from app.services.ffmpeg import (
+    ENCODER_PROFILE_NAMES,
+    HLS_FORMAT,
+    HLS_MASTER_PLAYLIST,
+    ensure_ffmpeg_tools,
+    generate_video_assets,
+    media_resolution,
+    probe_media,
+    remove_conversion_output,
+    target_size_audio_kbps,
+    target_size_bitrate,
+)
+from app.services.planner import describe_plan, plan_streams
+from app.services.processes import registry
 from app.services.rate_limit import enforce_rate_limit
-from app.services.storage import assemble_chunks, safe_filename, save_chunk, save_upload_file
+from app.services.storage import (
+    create_upload,
+    finish_upload,
+    read_upload,
+    received_ranges,
+    safe_filename,
+    save_upload_file,
+    write_chunk,
+)
+from app.services.worker import ConversionWorkerPool
 from app.db.session import SessionLocal
 
 router = APIRouter(prefix="/video", tags=["video"])
 
 
 ALLOWED_FORMATS = {"mp4", "mkv", "webm", "avi", "mov"}
+ALLOWED_TARGET_FORMATS = ALLOWED_FORMATS | {HLS_FORMAT}
 ALLOWED_MIME = {mime.strip() for mime in settings.allowed_mime_types.split(",")}
 
 
 def _resolve_user(
-    token: Optional[str], db: Session, header_user: Optional[User]
-) -> User:
+    token: Optional[str], db: Session, header_user: Optional[UserPrincipal]
+) -> UserPrincipal:
     if token:
         return get_user_from_token(token, db)
     if header_user:
@@ -54,12 +94,15 @@ def _ensure_size(size_bytes: int, file_path: Optional[str] = None) -> None:
 def _update_video_assets(video_id: int, original_path: str) -> None:
     db = SessionLocal()
     try:
-        thumbnail = generate_thumbnail(original_path, video_id)
-        preview = generate_preview_clip(original_path, video_id)
         video = db.query(Video).filter(Video.id == video_id).first()
+        duration = video.duration if video else None
+        assets = generate_video_assets(original_path, video_id, duration, settings.sprite_frames)
         if video:
-            video.thumbnail_path = thumbnail
-            video.preview_path = preview
+            video.thumbnail_path = assets["thumbnail"]
+            video.preview_path = assets["preview"]
+            video.sprite_path = assets["sprite"]
+            if not video.content_hash:
+                video.content_hash = cache.file_sha256(original_path)
             db.commit()
     finally:
         db.close()
@@ -71,11 +114,12 @@ async def upload_video(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
-    enforce_rate_limit(request)
+    await run_in_threadpool(enforce_rate_limit, request, current_user.id)
     _validate_upload(file)
-    original_path, size = await save_upload_file(file)
+    digest = hashlib.sha256()
+    original_path, size = await save_upload_file(file, digest)
     _ensure_size(size, original_path)
     try:
         ensure_ffmpeg_tools()
@@ -84,14 +128,17 @@ async def upload_video(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"FFmpeg not installed: {exc}",
         )
-    resolution, _ = get_video_info(original_path)
+    media = probe_media(original_path)
     video = Video(
         user_id=current_user.id,
         original_filename=file.filename,
         original_format=Path(file.filename).suffix.lower().lstrip("."),
-        original_resolution=resolution,
+        original_resolution=media_resolution(media),
         file_size=size,
         original_path=original_path,
+        duration=media.get("duration") if media else None,
+        media_info=media,
+        content_hash=digest.hexdigest(),
     )
     db.add(video)
     db.commit()
@@ -100,41 +147,102 @@ async def upload_video(
     return video
 
 
+def _owned_upload(upload_id: str, user: UserPrincipal) -> dict:
+    try:
+        meta = read_upload(upload_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    if meta["user_id"] != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return meta
+
+
+def _upload_state(upload_id: str, meta: dict) -> dict:
+    ranges = received_ranges(upload_id)
+    received = sum(end - start for start, end in ranges)
+    return {
+        "upload_id": upload_id,
+        "total_size": meta["total_size"],
+        "received_bytes": received,
+        "received": [list(item) for item in ranges],
+        "complete": received == meta["total_size"],
+    }
+
+
+@router.post("/upload/init")
+def init_chunked_upload(
+    request: Request,
+    original_filename: str = Form(...),
+    total_size: int = Form(...),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    enforce_rate_limit(request, current_user.id)
+    ext = Path(original_filename).suffix.lower().lstrip(".")
+    if ext not in ALLOWED_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported file format")
+    if total_size <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="total_size must be positive")
+    _ensure_size(total_size)
+    upload_id = create_upload(current_user.id, original_filename, total_size)
+    return _upload_state(upload_id, read_upload(upload_id))
+
+
+@router.get("/upload/{upload_id}")
+def chunked_upload_status(upload_id: str, current_user: UserPrincipal = Depends(get_current_user)):
+    meta = _owned_upload(upload_id, current_user)
+    return _upload_state(upload_id, meta)
+
+
 @router.post("/upload/chunk")
 async def upload_chunk(
-    request: Request,
     upload_id: str = Form(...),
-    chunk_index: int = Form(...),
+    offset: int = Form(...),
     chunk: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
-    enforce_rate_limit(request)
-    await save_chunk(upload_id, chunk_index, chunk)
-    return {"upload_id": upload_id, "chunk_index": chunk_index}
+    # Not rate limited: a single upload legitimately sends many chunks, and
+    # init/complete already are.
+    meta = _owned_upload(upload_id, current_user)
+    try:
+        await write_chunk(upload_id, offset, chunk)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    return _upload_state(upload_id, meta)
 
 
 @router.post("/upload/complete", response_model=VideoOut)
 async def complete_chunked_upload(
     request: Request,
+    background_tasks: BackgroundTasks,
     upload_id: str = Form(...),
-    original_filename: str = Form(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
-    enforce_rate_limit(request)
+    await run_in_threadpool(enforce_rate_limit, request, current_user.id)
+    meta = _owned_upload(upload_id, current_user)
+    original_filename = meta["original_filename"]
     ext = Path(original_filename).suffix.lower().lstrip(".")
-    if ext not in ALLOWED_FORMATS:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported file format")
-    original_path, size = assemble_chunks(upload_id, original_filename)
-    _ensure_size(size, original_path)
-    resolution, _ = get_video_info(original_path)
+    try:
+        original_path, size = finish_upload(upload_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+    try:
+        ensure_ffmpeg_tools()
+    except FileNotFoundError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"FFmpeg not installed: {exc}",
+        )
+    media = probe_media(original_path)
     video = Video(
         user_id=current_user.id,
         original_filename=original_filename,
         original_format=ext,
-        original_resolution=resolution,
+        original_resolution=media_resolution(media),
         file_size=size,
         original_path=original_path,
+        duration=media.get("duration") if media else None,
+        media_info=media,
     )
     db.add(video)
     db.commit()
@@ -143,116 +251,534 @@ async def complete_chunked_upload(
     return video
 
 
-def _conversion_task(conversion_id: int, payload: ConversionCreate) -> None:
+def _cache_key(video: Video, conversion: Conversion) -> str:
+    return cache.conversion_cache_key(
+        video.content_hash,
+        conversion.target_format,
+        conversion.target_resolution,
+        # In target-size mode the bitrate is derived, so the size is the key.
+        None if conversion.target_size_mb else conversion.target_bitrate,
+        conversion.target_fps,
+        conversion.target_codec,
+        conversion.keep_audio is not False,
+        bool(conversion.clean_metadata),
+        conversion.encoder_profile,
+        conversion.target_size_mb,
+    )
+
+
+def _progress_event(conversion: Conversion) -> dict:
+    return {
+        "id": conversion.id,
+        "status": conversion.status,
+        "progress": conversion.progress,
+        "speed": conversion.speed,
+        "eta_seconds": conversion.eta_seconds,
+        "plan": conversion.plan,
+        "download_url": conversion.download_url,
+        "error_message": conversion.error_message,
+    }
+
+
+def _commit_and_publish(db: Session, conversion: Conversion) -> None:
+    db.commit()
+    broker.publish(f"video:{conversion.id}", _progress_event(conversion))
+
+
+def _cacheable(video: Video, conversion: Conversion) -> bool:
+    # HLS output is a directory tree; the cache only tracks single files.
+    return cache.cache_enabled() and bool(video.content_hash) and conversion.target_format != HLS_FORMAT
+
+
+def _download_url(video: Video, conversion: Conversion) -> str:
+    if conversion.target_format == HLS_FORMAT:
+        return f"/api/video/stream/{conversion.id}/{HLS_MASTER_PLAYLIST}"
+    return f"/api/video/download/{video.id}?conversion_id={conversion.id}"
+
+
+def _finish(db: Session, video: Video, conversion: Conversion, output_path: str) -> bool:
+    """Mark ``conversion`` completed unless it was cancelled meanwhile.
+
+    The status check is part of the UPDATE because a cancel may be handled
+    by another API process, whose registry this one cannot see.
+    """
+    finished = (
+        db.query(Conversion)
+        .filter(Conversion.id == conversion.id, Conversion.status.in_(("queued", "processing")))
+        .update(
+            {
+                Conversion.output_path: output_path,
+                Conversion.download_url: _download_url(video, conversion),
+                Conversion.status: "completed",
+                Conversion.progress: 100,
+                Conversion.eta_seconds: 0,
+            },
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    db.refresh(conversion)
+    if finished:
+        broker.publish(f"video:{conversion.id}", _progress_event(conversion))
+    return bool(finished)
+
+
+def _complete_from_cache(db: Session, video: Video, conversion: Conversion) -> bool:
+    if not _cacheable(video, conversion):
+        return False
+    output_path = cache.lookup(db, _cache_key(video, conversion))
+    if not output_path:
+        return False
+    # A cancelled row is done either way; the shared cache file stays.
+    _finish(db, video, conversion, output_path)
+    return True
+
+
+def _claim_batch_siblings(db: Session, conversion: Conversion) -> List[Conversion]:
+    # Renditions of the same source in one batch share a single decode, so
+    # the worker that claims one of them takes the rest of the group with it.
+    # HLS and two-pass target-size jobs need their own ffmpeg runs.
+    if not conversion.batch_id or conversion.target_format == HLS_FORMAT or conversion.target_size_mb:
+        return []
+    candidates = (
+        db.query(Conversion)
+        .filter(
+            Conversion.batch_id == conversion.batch_id,
+            Conversion.video_id == conversion.video_id,
+            Conversion.id != conversion.id,
+            Conversion.status == "queued",
+            Conversion.target_format != HLS_FORMAT,
+            Conversion.target_size_mb.is_(None),
+        )
+        .order_by(Conversion.id)
+        .all()
+    )
+    claimed = []
+    for candidate in candidates:
+        updated = (
+            db.query(Conversion)
+            .filter(Conversion.id == candidate.id, Conversion.status == "queued")
+            .update({Conversion.status: "processing"}, synchronize_session=False)
+        )
+        db.commit()
+        if updated:
+            db.refresh(candidate)
+            claimed.append(candidate)
+    return claimed
+
+
+def _fail(db: Session, conversions: List[Conversion], message: str) -> None:
+    for conversion in conversions:
+        conversion.status = "failed"
+        conversion.error_message = message
+        _commit_and_publish(db, conversion)
+
+
+def _requeue(db: Session, conversions: List[Conversion]) -> None:
+    for conversion in conversions:
+        conversion.status = "queued"
+        conversion.progress = 0
+        conversion.speed = None
+        conversion.eta_seconds = None
+        _commit_and_publish(db, conversion)
+
+
+def _conversion_task(conversion_id: int) -> None:
     db = SessionLocal()
+    group_ids = [conversion_id]
     try:
         conversion = db.query(Conversion).filter(Conversion.id == conversion_id).first()
-        video = db.query(Video).filter(Video.id == payload.video_id).first()
-        if not conversion or not video:
+        if not conversion:
             return
-        conversion.status = "processing"
-        db.commit()
+        video = db.query(Video).filter(Video.id == conversion.video_id).first()
+        group = [conversion] + _claim_batch_siblings(db, conversion)
+        group_ids = [item.id for item in group]
+        registry.link(conversion_id, group_ids)
+        # A cancel may have landed between the claim and the link above.
+        for item in group:
+            db.refresh(item)
+        group = [item for item in group if item.status != "cancelled"]
+        if not group:
+            return
+        if not video:
+            _fail(db, group, "Video not found")
+            return
+        for item in group:
+            item.status = "processing"
+            _commit_and_publish(db, item)
 
-        def on_progress(progress: int) -> None:
-            conversion.progress = progress
+        if cache.cache_enabled() and not video.content_hash and os.path.exists(video.original_path):
+            video.content_hash = cache.file_sha256(video.original_path)
             db.commit()
+        group = [item for item in group if not _complete_from_cache(db, video, item)]
+        if not group:
+            return
+
+        def on_progress(progress: int, speed: Optional[float] = None, eta: Optional[float] = None) -> None:
+            for item in group:
+                item.progress = progress
+                item.speed = speed
+                item.eta_seconds = eta
+                _commit_and_publish(db, item)
 
         try:
             ensure_ffmpeg_tools()
         except FileNotFoundError as exc:
-            conversion.status = "failed"
-            conversion.error_message = f"FFmpeg not installed: {exc}"
-            db.commit()
+            _fail(db, group, f"FFmpeg not installed: {exc}")
             return
 
-        output_path = run_conversion_with_progress(
-            video.original_path,
-            conversion_id,
-            payload.target_format,
-            payload.target_resolution,
-            payload.target_bitrate,
-            payload.target_fps,
-            payload.target_codec,
-            payload.keep_audio,
-            payload.clean_metadata,
-            on_progress,
-        )
-        conversion.output_path = output_path
-        conversion.download_url = f"/api/video/download/{video.id}?conversion_id={conversion_id}"
-        conversion.status = "completed"
-        conversion.progress = 100
-        db.commit()
-    except Exception as exc:
-        conversion = db.query(Conversion).filter(Conversion.id == conversion_id).first()
-        if conversion:
-            conversion.status = "failed"
-            conversion.error_message = str(exc)
+        if video.media_info is None:
+            video.media_info = probe_media(video.original_path)
+            video.duration = video.media_info.get("duration") if video.media_info else None
             db.commit()
+
+        plans = {}
+        for item in group:
+            plans[item.id] = plan_streams(
+                video.media_info,
+                item.target_format,
+                item.target_resolution,
+                item.target_bitrate,
+                item.target_fps,
+                item.target_codec,
+                item.keep_audio is not False,
+            )
+            if item.target_size_mb:
+                # Hitting a size always needs a re-encode at the derived bitrate.
+                plans[item.id]["video"] = "encode"
+                item.target_bitrate = target_size_bitrate(
+                    item.target_size_mb,
+                    video.duration,
+                    target_size_audio_kbps(video.media_info, plans[item.id]),
+                )
+            item.plan = describe_plan(plans[item.id])
+            _commit_and_publish(db, item)
+
+        if len(group) == 1 and group[0].target_size_mb:
+            single = group[0]
+            output_paths = [
+                run_two_pass_conversion(
+                    video.original_path,
+                    single.id,
+                    single.target_format,
+                    single.target_resolution,
+                    single.target_bitrate,
+                    single.target_fps,
+                    single.target_codec,
+                    single.keep_audio is not False,
+                    bool(single.clean_metadata),
+                    on_progress,
+                    plans[single.id],
+                    video.duration,
+                    video.content_hash or f"video-{video.id}",
+                    single.encoder_profile,
+                )
+            ]
+        elif len(group) == 1:
+            single = group[0]
+            output_paths = [
+                run_conversion_with_progress(
+                    video.original_path,
+                    single.id,
+                    single.target_format,
+                    single.target_resolution,
+                    single.target_bitrate,
+                    single.target_fps,
+                    single.target_codec,
+                    single.keep_audio is not False,
+                    bool(single.clean_metadata),
+                    on_progress,
+                    plans[single.id],
+                    video.duration,
+                    video.media_info,
+                    single.encoder_profile,
+                )
+            ]
+        else:
+            output_paths = run_multi_output_conversion(
+                video.original_path,
+                [
+                    {
+                        "conversion_id": item.id,
+                        "target_format": item.target_format,
+                        "target_resolution": item.target_resolution,
+                        "target_bitrate": item.target_bitrate,
+                        "target_fps": item.target_fps,
+                        "target_codec": item.target_codec,
+                        "keep_audio": item.keep_audio is not False,
+                        "clean_metadata": bool(item.clean_metadata),
+                        "plan": plans[item.id],
+                        "encoder_profile": item.encoder_profile,
+                    }
+                    for item in group
+                ],
+                on_progress,
+                video.duration,
+            )
+        cancelled = registry.cancelled(conversion_id)
+        for item, output_path in zip(group, output_paths):
+            if item.id in cancelled or not _finish(db, video, item, output_path):
+                remove_conversion_output(item.id, item.target_format)
+                continue
+            if _cacheable(video, item):
+                cache.store(db, _cache_key(video, item), output_path)
+    except Exception as exc:
+        db.rollback()
+        unfinished = []
+        for item in db.query(Conversion).filter(Conversion.id.in_(group_ids)).all():
+            if item.status == "cancelled":
+                remove_conversion_output(item.id, item.target_format)
+            elif item.status != "completed":
+                unfinished.append(item)
+        if registry.timed_out(conversion_id):
+            _fail(db, unfinished, f"Timed out after {settings.ffmpeg_timeout_seconds:g} seconds")
+        elif registry.interrupted(conversion_id):
+            # Killed for a sibling's cancel or for shutdown, not by its own fault.
+            _requeue(db, unfinished)
+            conversion_pool.submit()
+        else:
+            _fail(db, unfinished, str(exc))
     finally:
         db.close()
 
 
+conversion_pool = ConversionWorkerPool(_conversion_task)
+
+
+def _validate_profile(profile, video: Video) -> None:
+    if profile.target_format not in ALLOWED_TARGET_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported target format")
+    if profile.encoder_profile and profile.encoder_profile not in ENCODER_PROFILE_NAMES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown encoder profile")
+    if profile.target_size_mb is None:
+        return
+    if profile.target_bitrate:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either target_bitrate or target_size_mb",
+        )
+    if profile.target_format == HLS_FORMAT or profile.target_size_mb <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported target size")
+    if video.duration:
+        try:
+            target_size_bitrate(profile.target_size_mb, video.duration)
+        except ValueError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+
+def _new_conversion(video: Video, user_id: int, profile, batch_id: Optional[str] = None) -> Conversion:
+    return Conversion(
+        video_id=video.id,
+        user_id=user_id,
+        batch_id=batch_id,
+        target_format=profile.target_format,
+        target_resolution=profile.target_resolution,
+        target_bitrate=profile.target_bitrate,
+        target_size_mb=profile.target_size_mb,
+        target_fps=profile.target_fps,
+        target_codec=profile.target_codec,
+        encoder_profile=profile.encoder_profile,
+        keep_audio=profile.keep_audio,
+        clean_metadata=profile.clean_metadata,
+        status="queued",
+        progress=0,
+    )
+
+
 @router.post("/convert", response_model=ConversionOut)
 def convert_video(
     payload: ConversionCreate,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
     video = db.query(Video).filter(Video.id == payload.video_id, Video.user_id == current_user.id).first()
     if not video:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Video not found")
-    if payload.target_format not in ALLOWED_FORMATS:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported target format")
-    conversion = Conversion(
-        video_id=video.id,
-        user_id=current_user.id,
-        target_format=payload.target_format,
-        target_resolution=payload.target_resolution,
-        target_bitrate=payload.target_bitrate,
-        target_fps=payload.target_fps,
-        target_codec=payload.target_codec,
-        status="queued",
-        progress=0,
-    )
+    _validate_profile(payload, video)
+    conversion = _new_conversion(video, current_user.id, payload)
     db.add(conversion)
     db.commit()
     db.refresh(conversion)
-    background_tasks.add_task(_conversion_task, conversion.id, payload)
+    if not _complete_from_cache(db, video, conversion):
+        # Short interactive jobs may borrow a slot from a running batch job.
+        short = bool(video.duration) and video.duration <= settings.preempt_max_seconds
+        conversion_pool.submit(preempt=conversion.id if short else None)
     return conversion
 
 
-@router.get("/history", response_model=List[HistoryItem])
-def history(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    conversions = (
+@router.post("/cancel/{conversion_id}", response_model=ConversionOut)
+def cancel_conversion(
+    conversion_id: int,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    conversion = (
         db.query(Conversion)
-        .filter(Conversion.user_id == current_user.id)
-        .order_by(Conversion.created_at.desc())
+        .filter(Conversion.id == conversion_id, Conversion.user_id == current_user.id)
+        .first()
+    )
+    if not conversion:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversion not found")
+    updated = (
+        db.query(Conversion)
+        .filter(Conversion.id == conversion_id, Conversion.status.in_(["queued", "processing"]))
+        .update({Conversion.status: "cancelled"}, synchronize_session=False)
+    )
+    db.commit()
+    if not updated:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Conversion already finished")
+    db.refresh(conversion)
+    broker.publish(f"video:{conversion.id}", _progress_event(conversion))
+    # The worker cleans up partial output once its ffmpeg has exited.
+    registry.cancel(conversion.id)
+    return conversion
+
+
+def _batch_summary(batch_id: str, conversions: List[Conversion]) -> dict:
+    counts = {}
+    for conversion in conversions:
+        counts[conversion.status] = counts.get(conversion.status, 0) + 1
+    total = len(conversions)
+    finished = counts.get("completed", 0) + counts.get("failed", 0) + counts.get("cancelled", 0)
+    if counts.get("completed", 0) == total:
+        batch_status = "completed"
+    elif counts.get("failed", 0) == total:
+        batch_status = "failed"
+    elif counts.get("cancelled", 0) == total:
+        batch_status = "cancelled"
+    elif finished == total:
+        batch_status = "partial"
+    elif counts.get("queued", 0) == total:
+        batch_status = "queued"
+    else:
+        batch_status = "processing"
+    return {
+        "batch_id": batch_id,
+        "status": batch_status,
+        "progress": sum(conversion.progress or 0 for conversion in conversions) // max(total, 1),
+        "total": total,
+        "completed": counts.get("completed", 0),
+        "failed": counts.get("failed", 0),
+        "cancelled": counts.get("cancelled", 0),
+        "conversions": conversions,
+    }
+
+
+@router.post("/convert/batch", response_model=BatchConversionOut)
+def convert_batch(
+    payload: BatchConversionCreate,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    """Queue every profile for every video under one batch id.
+
+    Profiles for the same source are claimed together by one worker and
+    encoded from a single ffmpeg decode; each rendition is still its own
+    conversion row with its own status, stream and download.
+    """
+    video_ids = list(dict.fromkeys(payload.video_ids))
+    if not video_ids or not payload.profiles:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No videos or profiles given")
+    if len(video_ids) * len(payload.profiles) > settings.batch_max_conversions:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Batch too large")
+    videos = (
+        db.query(Video)
+        .filter(Video.id.in_(video_ids), Video.user_id == current_user.id)
         .all()
     )
-    items = []
+    videos_by_id = {video.id: video for video in videos}
+    if len(videos_by_id) != len(video_ids):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Video not found")
+    for video in videos:
+        for profile in payload.profiles:
+            _validate_profile(profile, video)
+
+    batch_id = uuid.uuid4().hex
+    conversions = [
+        _new_conversion(videos_by_id[video_id], current_user.id, profile, batch_id)
+        for video_id in video_ids
+        for profile in payload.profiles
+    ]
+    db.add_all(conversions)
+    db.commit()
+    queued = False
     for conversion in conversions:
-        video = conversion.video
-        if video:
-            items.append({"video": video, "conversion": conversion})
-    return items
+        db.refresh(conversion)
+        if not _complete_from_cache(db, videos_by_id[conversion.video_id], conversion):
+            queued = True
+    if queued:
+        conversion_pool.submit()
+    return _batch_summary(batch_id, conversions)
 
 
-@router.get("/list", response_model=List[VideoOut])
-def list_videos(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return (
-        db.query(Video)
-        .filter(Video.user_id == current_user.id)
-        .order_by(Video.created_at.desc())
+@router.get("/convert/batch/{batch_id}", response_model=BatchConversionOut)
+def batch_status(
+    batch_id: str,
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    conversions = (
+        db.query(Conversion)
+        .filter(Conversion.batch_id == batch_id, Conversion.user_id == current_user.id)
+        .order_by(Conversion.id)
         .all()
     )
+    if not conversions:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Batch not found")
+    return _batch_summary(batch_id, conversions)
+
+
+@router.get("/cache/stats")
+def conversion_cache_stats(current_user: UserPrincipal = Depends(get_current_user)):
+    return cache.cache_stats()
+
+
+@router.get("/history", response_model=List[HistoryItem])
+def history(
+    response: Response,
+    page: PageParams = Depends(),
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    query = (
+        db.query(Conversion)
+        .options(joinedload(Conversion.video, innerjoin=True))
+        .filter(Conversion.user_id == current_user.id)
+    )
+    conversions, next_cursor = paginate(query, Conversion, page)
+    items = [{"video": conversion.video, "conversion": conversion} for conversion in conversions]
+    if page.fields:
+        return page_response(
+            project(items, page.fields, {"video": VideoOut, "conversion": ConversionOut}), next_cursor
+        )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return items
+
+
+@router.get("/list", response_model=List[VideoOut])
+def list_videos(
+    response: Response,
+    page: PageParams = Depends(),
+    db: Session = Depends(get_db),
+    current_user: UserPrincipal = Depends(get_current_user),
+):
+    query = db.query(Video).filter(Video.user_id == current_user.id)
+    if page.fields:
+        query = query.options(load_only(*load_columns(Video, VideoOut, page.fields)))
+    videos, next_cursor = paginate(query, Video, page)
+    if page.fields:
+        return page_response(project(videos, page.fields, VideoOut), next_cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return videos
 
 
 @router.get("/status/{conversion_id}", response_model=ConversionOut)
 def conversion_status(
     conversion_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
 ):
     conversion = (
         db.query(Conversion)
@@ -264,14 +790,52 @@ def conversion_status(
     return conversion
 
 
+@router.get("/status/{conversion_id}/stream")
+async def conversion_status_stream(
+    conversion_id: int,
+    token: Optional[str] = None,
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
+):
+    # EventSource cannot send headers, so the token may come as a query param.
+    def load() -> Optional[dict]:
+        db = SessionLocal()
+        try:
+            user = _resolve_user(token, db, current_user)
+            conversion = (
+                db.query(Conversion)
+                .filter(Conversion.id == conversion_id, Conversion.user_id == user.id)
+                .first()
+            )
+            return _progress_event(conversion) if conversion else None
+        finally:
+            db.close()
+
+    topic = f"video:{conversion_id}"
+    queue = broker.subscribe(topic)
+    try:
+        initial = await run_in_threadpool(load)
+    except Exception:
+        broker.unsubscribe(topic, queue)
+        raise
+    if initial is None:
+        broker.unsubscribe(topic, queue)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversion not found")
+    return StreamingResponse(
+        stream_events(topic, queue, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/preview/{video_id}")
 def preview_video(
+    request: Request,
     video_id: int,
     conversion_id: Optional[int] = None,
     kind: str = "original",
     token: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional),
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
 ):
     current_user = _resolve_user(token, db, current_user)
     video = db.query(Video).filter(Video.id == video_id, Video.user_id == current_user.id).first()
@@ -287,19 +851,20 @@ def preview_video(
         )
         if not conversion or not conversion.output_path:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversion not ready")
-        return FileResponse(conversion.output_path, filename=safe_filename(conversion.output_path))
+        return file_response(request, conversion.output_path, safe_filename(conversion.output_path))
     if not video.preview_path or not os.path.exists(video.preview_path):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Preview not ready")
-    return FileResponse(video.preview_path, filename=safe_filename(video.preview_path))
+    return file_response(request, video.preview_path, safe_filename(video.preview_path), REVALIDATE_CACHE)
 
 
 @router.get("/download/{video_id}")
 def download_video(
+    request: Request,
     video_id: int,
     conversion_id: Optional[int] = None,
     token: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional),
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
 ):
     current_user = _resolve_user(token, db, current_user)
     video = db.query(Video).filter(Video.id == video_id, Video.user_id == current_user.id).first()
@@ -313,19 +878,61 @@ def download_video(
         )
         if not conversion or not conversion.output_path:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversion not ready")
-        return FileResponse(conversion.output_path, filename=safe_filename(conversion.output_path))
-    return FileResponse(video.original_path, filename=video.original_filename)
+        return file_response(request, conversion.output_path, safe_filename(conversion.output_path))
+    return file_response(request, video.original_path, video.original_filename)
 
 
 @router.get("/thumbnail/{video_id}")
 def thumbnail(
+    request: Request,
     video_id: int,
     token: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional),
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
 ):
     current_user = _resolve_user(token, db, current_user)
     video = db.query(Video).filter(Video.id == video_id, Video.user_id == current_user.id).first()
     if not video or not video.thumbnail_path:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thumbnail not ready")
-    return FileResponse(video.thumbnail_path, filename=safe_filename(video.thumbnail_path))
+    return file_response(request, video.thumbnail_path, safe_filename(video.thumbnail_path))
+
+
+@router.get("/sprite/{video_id}")
+def sprite(
+    request: Request,
+    video_id: int,
+    token: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
+):
+    current_user = _resolve_user(token, db, current_user)
+    video = db.query(Video).filter(Video.id == video_id, Video.user_id == current_user.id).first()
+    if not video or not video.sprite_path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sprite not ready")
+    return file_response(request, video.sprite_path, safe_filename(video.sprite_path))
+
+
+@router.get("/stream/{conversion_id}/{asset_path:path}")
+def stream_hls(
+    request: Request,
+    conversion_id: int,
+    asset_path: str,
+    token: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: Optional[UserPrincipal] = Depends(get_current_user_optional),
+):
+    current_user = _resolve_user(token, db, current_user)
+    conversion = (
+        db.query(Conversion)
+        .filter(Conversion.id == conversion_id, Conversion.user_id == current_user.id)
+        .first()
+    )
+    if not conversion or conversion.target_format != HLS_FORMAT or not conversion.output_path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not ready")
+    root = Path(conversion.output_path).parent.resolve()
+    target = (root / asset_path).resolve()
+    if root not in target.parents or not target.is_file():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream asset not found")
+    if target.suffix == ".m3u8":
+        return playlist_response(request, str(target), token)
+    return file_response(request, str(target), target.name)
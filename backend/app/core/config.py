@@ -13,6 +13,35 @@ class Settings(BaseSettings):
     max_upload_mb: int = 1024
     allowed_mime_types: str = "video/mp4,video/x-matroska,video/webm,video/avi,video/quicktime"
     rate_limit_per_minute: int = 10
+    rate_limit_backend: str = "memory"
+    rate_limit_url: str = ""
+    auth_cache_size: int = 10000
+    auth_cache_seconds: float = 60
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 0
+    upload_buffer_kb: int = 1024
+    upload_ttl_hours: float = 24
+    conversion_workers: int = 0
+    conversion_poll_seconds: float = 2.0
+    conversion_heartbeat_seconds: float = 10.0
+    batch_max_conversions: int = 50
+    encoder_threads: int = 0
+    preempt_max_seconds: float = 300
+    ffmpeg_nice: int = 10
+    ffmpeg_ionice_class: int = 2
+    ffmpeg_ionice_level: int = 7
+    ffmpeg_max_memory_mb: int = 0
+    ffmpeg_timeout_seconds: float = 0
+    ffmpeg_reserved_cores: int = 0
+    image_workers: int = 0
+    image_max_pixels: int = 100_000_000
+    image_memory_budget_mb: int = 1024
+    conversion_cache_mb: int = 10240
+    passlog_cache_mb: int = 512
+    sprite_frames: int = 0
+    segment_min_seconds: float = 600
+    segment_count: int = 0
+    progress_interval_seconds: float = 0.5
 
     class Config:
         env_file = ".env"
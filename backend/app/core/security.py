@@ -1,12 +1,57 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with a different cost than bcrypt_rounds count as outdated, so they
+# are re-hashed on the next successful login.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
+
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_hash_executor_lock = threading.Lock()
+
+
+def password_hash_workers() -> int:
+    if settings.password_hash_workers > 0:
+        return settings.password_hash_workers
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def password_hash_executor() -> ThreadPoolExecutor:
+    """Threads reserved for bcrypt, separate from the request threadpool.
+
+    bcrypt releases the GIL, so each worker can occupy a core; capping the
+    workers caps how much CPU a burst of logins can take from other requests,
+    and the excess waits here instead of in the shared threadpool.
+    """
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is None:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=password_hash_workers(), thread_name_prefix="password-hash"
+            )
+        return _hash_executor
+
+
+def shutdown_password_hash_executor() -> None:
+    global _hash_executor
+    with _hash_executor_lock:
+        executor, _hash_executor = _hash_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _run_password_job(func: Callable, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_executor(), partial(func, *args))
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -17,6 +62,15 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def hash_password(password: str) -> str:
+    return await _run_password_job(pwd_context.hash, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Check a password; also return a new hash when the stored one is outdated."""
+    return await _run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
 def create_access_token(subject: str) -> str:
     expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     to_encode: Dict[str, Any] = {"exp": expire, "sub": subject, "type": "access"}
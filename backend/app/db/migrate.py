@@ -0,0 +1,26 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.db.base import Base
+
+
+def add_missing_columns(engine: Engine) -> None:
+    """Add columns and indexes declared on models but missing from existing tables.
+
+    ``create_all`` only creates missing tables, so databases created by an
+    older release would otherwise fail on the first query touching a new
+    column. New columns are always nullable, which SQLite can add in place.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
@@ -3,3 +3,4 @@ from app.models.video import Video  # noqa: F401
 from app.models.conversion import Conversion  # noqa: F401
 from app.models.image import Image  # noqa: F401
 from app.models.image_conversion import ImageConversion  # noqa: F401
+from app.models.conversion_cache import ConversionCacheEntry  # noqa: F401
@@ -2,10 +2,14 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api import auth, video, image
+from app.api.pagination import NEXT_CURSOR_HEADER
 from app.core.config import settings
+from app.core.security import shutdown_password_hash_executor
 from app.db.base import Base
+from app.db.migrate import add_missing_columns
 from app.db.session import engine
-from app.services.storage import ensure_storage_dirs
+from app.services.image import shutdown_image_pool
+from app.services.storage import ensure_storage_dirs, expire_stale_uploads
 
 app = FastAPI(title=settings.app_name)
 
@@ -20,15 +24,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # ✅ Startup tasks
 @app.on_event("startup")
 def startup_event() -> None:
     ensure_storage_dirs()
+    expire_stale_uploads()
     # Import models so SQLAlchemy registers tables before create_all
     from app.db import models  # noqa: F401
     Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    video.conversion_pool.start()
+
+
+@app.on_event("shutdown")
+def shutdown_event() -> None:
+    video.conversion_pool.stop()
+    shutdown_image_pool()
+    shutdown_password_hash_executor()
 
 # ✅ API routes
 app.include_router(auth.router, prefix=settings.api_v1_prefix)
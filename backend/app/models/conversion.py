@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -7,20 +7,31 @@ from app.db.base import Base
 
 class Conversion(Base):
     __tablename__ = "conversions"
+    __table_args__ = (Index("ix_conversions_user_created", "user_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     video_id = Column(Integer, ForeignKey("videos.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    batch_id = Column(String, nullable=True, index=True)
     target_format = Column(String, nullable=False)
     target_resolution = Column(String, nullable=True)
     target_bitrate = Column(String, nullable=True)
+    target_size_mb = Column(Float, nullable=True)
     target_fps = Column(String, nullable=True)
     target_codec = Column(String, nullable=True)
+    encoder_profile = Column(String, nullable=True)
+    keep_audio = Column(Boolean, default=True)
+    clean_metadata = Column(Boolean, default=False)
+    plan = Column(String, nullable=True)
     status = Column(String, default="queued")
     progress = Column(Integer, default=0)
+    speed = Column(Float, nullable=True)
+    eta_seconds = Column(Float, nullable=True)
     output_path = Column(String, nullable=True)
     download_url = Column(String, nullable=True)
     error_message = Column(String, nullable=True)
+    # time.time() of the owning worker's last heartbeat while "processing".
+    heartbeat_at = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
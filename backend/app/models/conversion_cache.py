@@ -0,0 +1,15 @@
+from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy.sql import func
+
+from app.db.base import Base
+
+
+class ConversionCacheEntry(Base):
+    __tablename__ = "conversion_cache"
+
+    key = Column(String, primary_key=True)
+    output_path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False, default=0)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -7,6 +7,7 @@ from app.db.base import Base
 
 class Image(Base):
     __tablename__ = "images"
+    __table_args__ = (Index("ix_images_user_created", "user_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -15,6 +16,14 @@ class Image(Base):
     original_resolution = Column(String, nullable=True)
     file_size = Column(Integer, nullable=False)
     original_path = Column(String, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    mode = Column(String, nullable=True)
+    orientation = Column(Integer, nullable=True)
+    has_icc_profile = Column(Boolean, nullable=True)
+    frame_count = Column(Integer, nullable=True)
+    thumbnail_path = Column(String, nullable=True)
+    placeholder = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     owner = relationship("User", back_populates="images")
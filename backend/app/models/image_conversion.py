@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -7,6 +7,7 @@ from app.db.base import Base
 
 class ImageConversion(Base):
     __tablename__ = "image_conversions"
+    __table_args__ = (Index("ix_image_conversions_user_created", "user_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     image_id = Column(Integer, ForeignKey("images.id"), nullable=False)
@@ -19,6 +20,7 @@ class ImageConversion(Base):
     output_path = Column(String, nullable=True)
     download_url = Column(String, nullable=True)
     error_message = Column(String, nullable=True)
+    peak_rss_mb = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, JSON, String
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -7,6 +7,7 @@ from app.db.base import Base
 
 class Video(Base):
     __tablename__ = "videos"
+    __table_args__ = (Index("ix_videos_user_created", "user_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -17,6 +18,10 @@ class Video(Base):
     original_path = Column(String, nullable=False)
     thumbnail_path = Column(String, nullable=True)
     preview_path = Column(String, nullable=True)
+    sprite_path = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True, index=True)
+    duration = Column(Float, nullable=True)
+    media_info = Column(JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     owner = relationship("User", back_populates="videos")
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, EmailStr, constr
 
@@ -34,8 +34,10 @@ class VideoOut(BaseModel):
     original_format: str
     original_resolution: Optional[str]
     file_size: int
+    duration: Optional[float] = None
     thumbnail_path: Optional[str]
     preview_path: Optional[str]
+    sprite_path: Optional[str] = None
     created_at: datetime
 
     class Config:
@@ -48,6 +50,14 @@ class ImageOut(BaseModel):
     original_format: str
     original_resolution: Optional[str]
     file_size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    mode: Optional[str] = None
+    orientation: Optional[int] = None
+    has_icc_profile: Optional[bool] = None
+    frame_count: Optional[int] = None
+    thumbnail_path: Optional[str] = None
+    placeholder: Optional[str] = None
     created_at: datetime
 
     class Config:
@@ -61,6 +71,17 @@ class ImageConversionCreate(BaseModel):
     quality: Optional[int] = None
 
 
+class ImageDerivative(BaseModel):
+    target_format: str
+    target_resolution: Optional[str] = None
+    quality: Optional[int] = None
+
+
+class ImageBatchConversionCreate(BaseModel):
+    image_id: int
+    outputs: List[ImageDerivative]
+
+
 class ImageConversionOut(BaseModel):
     id: int
     image_id: int
@@ -71,6 +92,7 @@ class ImageConversionOut(BaseModel):
     progress: int
     output_path: Optional[str]
     download_url: Optional[str]
+    peak_rss_mb: Optional[float] = None
     created_at: datetime
 
     class Config:
@@ -87,22 +109,47 @@ class ConversionCreate(BaseModel):
     target_format: str
     target_resolution: Optional[str] = None
     target_bitrate: Optional[str] = None
+    target_size_mb: Optional[float] = None
     target_fps: Optional[str] = None
     target_codec: Optional[str] = None
+    encoder_profile: Optional[str] = None
     keep_audio: bool = True
     clean_metadata: bool = False
 
 
+class ConversionProfile(BaseModel):
+    target_format: str
+    target_resolution: Optional[str] = None
+    target_bitrate: Optional[str] = None
+    target_size_mb: Optional[float] = None
+    target_fps: Optional[str] = None
+    target_codec: Optional[str] = None
+    encoder_profile: Optional[str] = None
+    keep_audio: bool = True
+    clean_metadata: bool = False
+
+
+class BatchConversionCreate(BaseModel):
+    video_ids: List[int]
+    profiles: List[ConversionProfile]
+
+
 class ConversionOut(BaseModel):
     id: int
     video_id: int
+    batch_id: Optional[str] = None
     target_format: str
     target_resolution: Optional[str]
     target_bitrate: Optional[str]
+    target_size_mb: Optional[float] = None
     target_fps: Optional[str]
     target_codec: Optional[str]
+    encoder_profile: Optional[str] = None
     status: str
     progress: int
+    speed: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    plan: Optional[str] = None
     output_path: Optional[str]
     download_url: Optional[str]
     created_at: datetime
@@ -111,6 +158,17 @@ class ConversionOut(BaseModel):
         orm_mode = True
 
 
+class BatchConversionOut(BaseModel):
+    batch_id: str
+    status: str
+    progress: int
+    total: int
+    completed: int
+    failed: int
+    cancelled: int = 0
+    conversions: List[ConversionOut]
+
+
 class HistoryItem(BaseModel):
     video: VideoOut
     conversion: ConversionOut
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.conversion import Conversion
+from app.models.conversion_cache import ConversionCacheEntry
+from app.services.ffmpeg import build_conversion_command
+
+_INPUT_PLACEHOLDER = "{input}"
+_OUTPUT_PLACEHOLDER = "{output}"
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def cache_enabled() -> bool:
+    return settings.conversion_cache_mb > 0
+
+
+def cache_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        while True:
+            data = source.read(1024 * 1024)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def conversion_cache_key(
+    source_hash: str,
+    target_format: str,
+    target_resolution: Optional[str],
+    target_bitrate: Optional[str],
+    target_fps: Optional[str],
+    target_codec: Optional[str],
+    keep_audio: bool,
+    clean_metadata: bool,
+    encoder_profile: Optional[str] = None,
+    target_size_mb: Optional[float] = None,
+) -> str:
+    # Hash the ffmpeg arguments rather than the request fields so that requests
+    # which produce the same command (e.g. default vs explicit codec) share outputs.
+    command = build_conversion_command(
+        _INPUT_PLACEHOLDER,
+        _OUTPUT_PLACEHOLDER,
+        target_format,
+        target_resolution,
+        target_bitrate,
+        target_fps,
+        target_codec,
+        keep_audio,
+        clean_metadata,
+        encoder_profile=encoder_profile,
+    )
+    entry = {"source": source_hash, "command": command}
+    if target_size_mb:
+        entry["target_size_mb"] = target_size_mb
+    payload = json.dumps(entry, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def lookup(db: Session, key: str) -> Optional[str]:
+    if not cache_enabled():
+        return None
+    entry = db.query(ConversionCacheEntry).filter(ConversionCacheEntry.key == key).first()
+    if entry and not os.path.exists(entry.output_path):
+        db.delete(entry)
+        db.commit()
+        entry = None
+    if not entry:
+        _count("misses")
+        return None
+    entry.hits = (entry.hits or 0) + 1
+    entry.last_used_at = func.now()
+    db.commit()
+    _count("hits")
+    return entry.output_path
+
+
+def store(db: Session, key: str, output_path: str) -> None:
+    if not cache_enabled() or not os.path.exists(output_path):
+        return
+    entry = db.query(ConversionCacheEntry).filter(ConversionCacheEntry.key == key).first()
+    if entry is None:
+        entry = ConversionCacheEntry(key=key)
+        db.add(entry)
+    entry.output_path = output_path
+    entry.size = Path(output_path).stat().st_size
+    entry.last_used_at = func.now()
+    db.commit()
+    evict(db)
+
+
+def evict(db: Session) -> int:
+    """Drop least recently used entries until the cache fits ``conversion_cache_mb``.
+
+    Conversions completed from an entry share its file, so they are marked
+    ``expired`` (and lose their download URL) before the file is removed.
+    """
+    limit = settings.conversion_cache_mb * 1024 * 1024
+    total = db.query(func.coalesce(func.sum(ConversionCacheEntry.size), 0)).scalar()
+    if total <= limit:
+        return 0
+    removed = 0
+    entries = db.query(ConversionCacheEntry).order_by(ConversionCacheEntry.last_used_at.asc()).all()
+    for entry in entries:
+        if total <= limit:
+            break
+        db.query(Conversion).filter(Conversion.output_path == entry.output_path).update(
+            {
+                Conversion.status: "expired",
+                Conversion.output_path: None,
+                Conversion.download_url: None,
+                Conversion.error_message: "Output expired from the conversion cache",
+            },
+            synchronize_session=False,
+        )
+        if os.path.exists(entry.output_path):
+            os.remove(entry.output_path)
+        total -= entry.size or 0
+        db.delete(entry)
+        removed += 1
+    db.commit()
+    _count("evictions", removed)
+    return removed
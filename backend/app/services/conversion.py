@@ -1,19 +1,376 @@
-import re
-from typing import Optional
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 
-from app.services.ffmpeg import convert_video, get_video_info
+from app.core.config import settings
+from app.services.ffmpeg import (
+    HLS_FORMAT,
+    build_concat_command,
+    build_conversion_command,
+    build_multi_output_command,
+    build_split_command,
+    build_two_pass_commands,
+    convert_video,
+    ensure_ffmpeg_tools,
+    get_video_info,
+    passlog_prefix,
+    passlog_ready,
+    prune_passlogs,
+    publish_passlog,
+    start_with_progress,
+)
+from app.services.processes import failure_message, limited, registry
+from app.services.storage import CONVERTED_DIR, PASSLOGS_DIR, ensure_storage_dirs
+from app.services.worker import encoder_threads
 
-_TIME_RE = re.compile(r"time=(\d+):(\d+):(\d+\.\d+)")
+# Re-send unchanged progress at least this often so speed/ETA stay fresh.
+PROGRESS_HEARTBEAT_SECONDS = 5.0
 
 
-def parse_ffmpeg_time(line: str) -> Optional[float]:
-    match = _TIME_RE.search(line)
-    if not match:
+def read_progress(stream: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """Group ffmpeg ``-progress`` key=value lines into one dict per update."""
+    block: Dict[str, str] = {}
+    for line in stream:
+        key, separator, value = line.strip().partition("=")
+        if not separator:
+            continue
+        block[key] = value.strip()
+        if key == "progress":
+            yield block
+            block = {}
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    if not value or value == "N/A":
+        return None
+    try:
+        return float(value.rstrip("x").replace("kbits/s", ""))
+    except ValueError:
         return None
-    hours = int(match.group(1))
-    minutes = int(match.group(2))
-    seconds = float(match.group(3))
-    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_progress(block: Dict[str, str]) -> Dict[str, Optional[float]]:
+    # out_time_ms is in microseconds as well, despite its name.
+    out_time_us = _number(block.get("out_time_us")) or _number(block.get("out_time_ms"))
+    return {
+        "out_time": out_time_us / 1_000_000 if out_time_us is not None else None,
+        "fps": _number(block.get("fps")),
+        "speed": _number(block.get("speed")),
+        "bitrate": _number(block.get("bitrate")),
+        "done": block.get("progress") == "end",
+    }
+
+
+class ProgressReporter:
+    """Throttle progress callbacks and derive percent and ETA.
+
+    ``on_progress(percent, speed, eta_seconds)`` fires only when the integer
+    percent moved and the interval elapsed (or on the heartbeat), so the
+    callback's database commit no longer runs for every ffmpeg update.
+    """
+
+    def __init__(
+        self,
+        on_progress: Callable[[int, Optional[float], Optional[float]], None],
+        duration: Optional[float],
+        interval: Optional[float] = None,
+    ) -> None:
+        self._on_progress = on_progress
+        self._duration = duration
+        self._interval = settings.progress_interval_seconds if interval is None else interval
+        self._lock = threading.Lock()
+        self._last_percent: Optional[int] = None
+        self._last_emit = 0.0
+
+    def update(self, out_time: Optional[float], speed: Optional[float]) -> None:
+        if out_time is None or not self._duration or self._duration <= 0:
+            return
+        percent = max(0, min(int(out_time / self._duration * 100), 99))
+        eta = max(self._duration - out_time, 0.0) / speed if speed else None
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_emit
+            if elapsed < self._interval:
+                return
+            if percent == self._last_percent and elapsed < PROGRESS_HEARTBEAT_SECONDS:
+                return
+            self._last_percent = percent
+            self._last_emit = now
+            self._on_progress(percent, speed, round(eta, 1) if eta is not None else None)
+
+
+def follow_progress(
+    process: subprocess.Popen,
+    on_update: Callable[[Dict[str, Optional[float]]], None],
+) -> None:
+    """Feed each progress update to ``on_update``; raise if ffmpeg fails."""
+    errors: deque = deque(maxlen=20)
+    drain = threading.Thread(target=lambda: errors.extend(process.stderr), daemon=True)
+    drain.start()
+    for block in read_progress(process.stdout):
+        on_update(parse_progress(block))
+    returncode = process.wait()
+    drain.join(timeout=1)
+    if returncode != 0:
+        raise RuntimeError(failure_message(returncode, "".join(errors).strip().splitlines()))
+
+
+def segment_count() -> int:
+    """Parallel segment encoders for one job, capped at its slot's thread budget.
+
+    Each segment is a separate ffmpeg, so without the cap every pool slot
+    would run a full machine's worth of encoders at once.
+    """
+    requested = settings.segment_count if settings.segment_count > 0 else os.cpu_count() or 1
+    return max(1, min(requested, encoder_threads()))
+
+
+def should_segment(
+    duration: Optional[float],
+    plan: Optional[Dict[str, str]] = None,
+    target_format: Optional[str] = None,
+) -> bool:
+    if target_format == HLS_FORMAT:
+        return False
+    if not duration or duration < settings.segment_min_seconds:
+        return False
+    if plan and plan.get("video") == "copy":
+        return False
+    return segment_count() > 1
+
+
+def _run_checked(command: list, conversion_id: Optional[int] = None) -> None:
+    process = subprocess.Popen(
+        limited(command),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+    )
+    if conversion_id is not None:
+        registry.add(conversion_id, process)
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(failure_message(process.returncode, stderr.strip().splitlines()))
+
+
+def run_segmented_conversion(
+    input_path: str,
+    conversion_id: int,
+    target_format: str,
+    target_resolution: Optional[str],
+    target_bitrate: Optional[str],
+    target_fps: Optional[str],
+    target_codec: Optional[str],
+    keep_audio: bool,
+    clean_metadata: bool,
+    on_progress,
+    plan: Optional[Dict[str, str]],
+    duration: float,
+    encoder_profile: Optional[str] = None,
+) -> str:
+    """Split on keyframes, encode the video segments in parallel, then concat.
+
+    Each segment is its own ffmpeg process, so a small thread pool is enough to
+    keep every core busy; the threads only wait on the children.
+    """
+    ensure_ffmpeg_tools()
+    ensure_storage_dirs()
+    output_path = CONVERTED_DIR / f"{conversion_id}.{target_format}"
+    work_dir = CONVERTED_DIR / f"{conversion_id}_segments"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+    try:
+        count = segment_count()
+        segment_times = [duration * index / count for index in range(1, count)]
+        _run_checked(
+            build_split_command(input_path, str(work_dir / "source_%04d.mkv"), segment_times),
+            conversion_id,
+        )
+        sources = sorted(work_dir.glob("source_*.mkv"))
+        if not sources:
+            raise RuntimeError("Segmenting produced no output")
+
+        threads_per_segment = max(1, encoder_threads() // len(sources))
+        reporter = ProgressReporter(on_progress, duration)
+        encoded_seconds: List[float] = [0.0] * len(sources)
+        speeds: List[float] = [0.0] * len(sources)
+
+        def encode(index: int, source: Path) -> Path:
+            target = work_dir / f"encoded_{index:04d}.{target_format}"
+            command = build_conversion_command(
+                str(source),
+                str(target),
+                target_format,
+                target_resolution,
+                target_bitrate,
+                target_fps,
+                target_codec,
+                False,
+                False,
+                encoder_profile=encoder_profile,
+                threads=threads_per_segment,
+            )
+
+            def on_update(snapshot: Dict[str, Optional[float]]) -> None:
+                if snapshot["out_time"] is not None:
+                    encoded_seconds[index] = snapshot["out_time"]
+                speeds[index] = 0.0 if snapshot["done"] else snapshot["speed"] or 0.0
+                reporter.update(sum(encoded_seconds), sum(speeds) or None)
+
+            follow_progress(start_with_progress(command, conversion_id), on_update)
+            return target
+
+        with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+            futures = [executor.submit(encode, index, source) for index, source in enumerate(sources)]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = next((future for future in futures if future in done and future.exception()), None)
+            if failed is not None:
+                # Stop the sibling segments now; leaving the ``with`` block
+                # would otherwise wait for them to encode to the end.
+                registry.terminate(conversion_id)
+                raise failed.exception()
+            encoded = [future.result() for future in futures]
+
+        list_path = work_dir / "segments.txt"
+        list_path.write_text("".join(f"file '{path.resolve()}'\n" for path in encoded))
+        _run_checked(
+            build_concat_command(
+                str(list_path),
+                input_path,
+                str(output_path),
+                target_format,
+                keep_audio,
+                clean_metadata,
+                plan,
+            ),
+            conversion_id,
+        )
+        return str(output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_two_pass_conversion(
+    input_path: str,
+    conversion_id: int,
+    target_format: str,
+    target_resolution: Optional[str],
+    target_bitrate: str,
+    target_fps: Optional[str],
+    target_codec: Optional[str],
+    keep_audio: bool,
+    clean_metadata: bool,
+    on_progress,
+    plan: Optional[Dict[str, str]],
+    duration: float,
+    source_key: str,
+    encoder_profile: Optional[str] = None,
+) -> str:
+    """Encode at ``target_bitrate`` in two passes, reusing a stored pass-1 log.
+
+    Progress spans both passes; when the log is reused only pass 2 runs.
+    """
+    ensure_ffmpeg_tools()
+    ensure_storage_dirs()
+    output_path = CONVERTED_DIR / f"{conversion_id}.{target_format}"
+    prefix = passlog_prefix(
+        source_key, target_format, target_resolution, target_fps, target_codec, encoder_profile
+    )
+    # Pass 1 writes under a private name so concurrent jobs never read a half-written log.
+    temporary_prefix = PASSLOGS_DIR / f"{prefix.name}.{conversion_id}"
+    reuse = passlog_ready(prefix)
+    first, final = build_two_pass_commands(
+        input_path,
+        str(output_path),
+        target_format,
+        target_resolution,
+        target_bitrate,
+        target_fps,
+        target_codec,
+        keep_audio,
+        clean_metadata,
+        plan,
+        encoder_profile,
+        encoder_threads(),
+        temporary_prefix,
+        prefix,
+    )
+    passes = 2 if first and not reuse else 1
+    reporter = ProgressReporter(on_progress, duration * passes)
+    try:
+        if first and not reuse:
+            follow_progress(
+                start_with_progress(first, conversion_id),
+                lambda snapshot: reporter.update(snapshot["out_time"], snapshot["speed"]),
+            )
+            publish_passlog(temporary_prefix, prefix)
+        offset = duration * (passes - 1)
+        follow_progress(
+            start_with_progress(final, conversion_id),
+            lambda snapshot: reporter.update(
+                offset + snapshot["out_time"] if snapshot["out_time"] is not None else None,
+                snapshot["speed"],
+            ),
+        )
+    finally:
+        for path in PASSLOGS_DIR.glob(f"{temporary_prefix.name}-*"):
+            path.unlink(missing_ok=True)
+        prune_passlogs()
+    return str(output_path)
+
+
+def run_multi_output_conversion(
+    input_path: str,
+    outputs: List[dict],
+    on_progress,
+    duration: Optional[float] = None,
+) -> List[str]:
+    """Encode several renditions of one source from a single decode.
+
+    Each entry of ``outputs`` carries ``conversion_id``, the target_* fields,
+    ``keep_audio``, ``clean_metadata`` and optional ``plan`` and
+    ``encoder_profile``. The slot's thread budget is split between outputs.
+    """
+    ensure_ffmpeg_tools()
+    ensure_storage_dirs()
+    if duration is None:
+        _, duration = get_video_info(input_path)
+    output_paths = []
+    commands = []
+    threads = max(1, encoder_threads() // len(outputs))
+    for output in outputs:
+        output_path = CONVERTED_DIR / f"{output['conversion_id']}.{output['target_format']}"
+        output_paths.append(str(output_path))
+        commands.append(
+            build_conversion_command(
+                input_path,
+                str(output_path),
+                output["target_format"],
+                output["target_resolution"],
+                output["target_bitrate"],
+                output["target_fps"],
+                output["target_codec"],
+                output["keep_audio"],
+                output["clean_metadata"],
+                output.get("plan"),
+                output.get("encoder_profile"),
+                threads,
+            )
+        )
+    process = start_with_progress(
+        build_multi_output_command(input_path, commands),
+        outputs[0]["conversion_id"],
+    )
+    reporter = ProgressReporter(on_progress, duration)
+    follow_progress(process, lambda snapshot: reporter.update(snapshot["out_time"], snapshot["speed"]))
+    return output_paths
 
 
 def run_conversion_with_progress(
@@ -27,8 +384,29 @@ def run_conversion_with_progress(
     keep_audio: bool,
     clean_metadata: bool,
     on_progress,
+    plan: Optional[Dict[str, str]] = None,
+    duration: Optional[float] = None,
+    media: Optional[dict] = None,
+    encoder_profile: Optional[str] = None,
 ) -> str:
-    _, duration = get_video_info(input_path)
+    if duration is None:
+        _, duration = get_video_info(input_path)
+    if should_segment(duration, plan, target_format):
+        return run_segmented_conversion(
+            input_path,
+            conversion_id,
+            target_format,
+            target_resolution,
+            target_bitrate,
+            target_fps,
+            target_codec,
+            keep_audio,
+            clean_metadata,
+            on_progress,
+            plan,
+            duration,
+            encoder_profile,
+        )
     output_path, process = convert_video(
         input_path,
         conversion_id,
@@ -39,15 +417,11 @@ def run_conversion_with_progress(
         target_codec,
         keep_audio,
         clean_metadata,
+        plan,
+        media,
+        encoder_profile,
+        encoder_threads(),
     )
-    if process.stdout is None:
-        process.wait()
-        return output_path
-
-    for line in process.stdout:
-        timestamp = parse_ffmpeg_time(line)
-        if timestamp is not None and duration and duration > 0:
-            progress = min(int((timestamp / duration) * 100), 99)
-            on_progress(progress)
-    process.wait()
+    reporter = ProgressReporter(on_progress, duration)
+    follow_progress(process, lambda snapshot: reporter.update(snapshot["out_time"], snapshot["speed"]))
     return output_path
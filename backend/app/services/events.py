@@ -0,0 +1,80 @@
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Dict, List, Tuple
+
+FINAL_STATUSES = {"completed", "failed", "cancelled", "expired"}
+KEEPALIVE_SECONDS = 15.0
+
+
+class ProgressBroker:
+    """In-process pub/sub between conversion workers and SSE subscribers.
+
+    Workers publish from their own threads; each subscriber owns an asyncio
+    queue on the event loop that serves its request, so delivery goes through
+    ``call_soon_threadsafe``. Publishing with no subscribers is a dict lookup.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def subscribe(self, topic: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(topic, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue) -> None:
+        with self._lock:
+            remaining = [entry for entry in self._subscribers.get(topic, []) if entry[1] is not queue]
+            if remaining:
+                self._subscribers[topic] = remaining
+            else:
+                self._subscribers.pop(topic, None)
+
+    def subscriber_count(self, topic: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(topic, []))
+
+    def publish(self, topic: str, event: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, []))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down; it will never read again.
+                self.unsubscribe(topic, queue)
+
+
+broker = ProgressBroker()
+
+
+def format_sse(event: dict) -> str:
+    # Default "message" events, so EventSource.onmessage receives every
+    # update; the status travels in the JSON payload.
+    return f"data: {json.dumps(event, default=str)}\n\n"
+
+
+async def stream_events(topic: str, queue: asyncio.Queue, initial: dict) -> AsyncIterator[str]:
+    """Yield SSE frames until the job reaches a final status.
+
+    ``queue`` must be subscribed before ``initial`` is read from the database,
+    otherwise a completion published in between would be missed.
+    """
+    try:
+        yield format_sse(initial)
+        if initial.get("status") in FINAL_STATUSES:
+            return
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(event)
+            if event.get("status") in FINAL_STATUSES:
+                return
+    finally:
+        broker.unsubscribe(topic, queue)
@@ -1,14 +1,26 @@
+import hashlib
 import json
+import math
+import os
 import shutil
 import subprocess
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from app.services.storage import CONVERTED_DIR, PREVIEWS_DIR, THUMBNAILS_DIR, ensure_storage_dirs
+from app.core.config import settings
+from app.services.processes import limited, registry, run_limited
+from app.services.storage import (
+    CONVERTED_DIR,
+    PASSLOGS_DIR,
+    PREVIEWS_DIR,
+    SPRITES_DIR,
+    THUMBNAILS_DIR,
+    ensure_storage_dirs,
+)
 
 
 def _run_command(command: list) -> subprocess.CompletedProcess:
-    return subprocess.run(command, capture_output=True, text=True, check=False)
+    return run_limited(command)
 
 
 def ensure_ffmpeg_tools() -> None:
@@ -17,69 +29,169 @@ def ensure_ffmpeg_tools() -> None:
         raise FileNotFoundError(f"Missing tools: {', '.join(missing)}")
 
 
-def get_video_info(path: str) -> Tuple[Optional[str], Optional[float]]:
+KEYFRAME_SCAN_SECONDS = 30
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, "", "N/A") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value) -> Optional[int]:
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+
+def _frame_rate(value: Optional[str]) -> Optional[float]:
+    if not value or value == "0/0":
+        return None
+    if "/" in value:
+        numerator, denominator = value.split("/", 1)
+        numerator_f, denominator_f = _to_float(numerator), _to_float(denominator)
+        if not numerator_f or not denominator_f:
+            return None
+        return round(numerator_f / denominator_f, 3)
+    return _to_float(value)
+
+
+def _rotation(stream: dict) -> int:
+    for side_data in stream.get("side_data_list", []):
+        if "rotation" in side_data:
+            return int(_to_float(side_data["rotation"]) or 0)
+    return int(_to_float(stream.get("tags", {}).get("rotate")) or 0)
+
+
+def _keyframe_interval(packets: list, stream_index: int) -> Optional[float]:
+    times = [
+        _to_float(packet.get("pts_time"))
+        for packet in packets
+        if packet.get("stream_index") == stream_index and "K" in packet.get("flags", "")
+    ]
+    times = sorted(time for time in times if time is not None)
+    if len(times) < 2:
+        return None
+    return round((times[-1] - times[0]) / (len(times) - 1), 3)
+
+
+def probe_media(path: str) -> Optional[dict]:
+    """Probe everything later steps need in a single ffprobe run.
+
+    The result is persisted on ``Video.media_info`` so progress tracking,
+    stream planning and asset generation never have to re-probe the file.
+    """
     ensure_ffmpeg_tools()
     command = [
         "ffprobe",
         "-v",
         "error",
-        "-select_streams",
-        "v:0",
+        "-read_intervals",
+        f"%+{KEYFRAME_SCAN_SECONDS}",
         "-show_entries",
-        "stream=width,height,duration:format=duration",
+        "stream=index,codec_type,codec_name,pix_fmt,width,height,r_frame_rate,avg_frame_rate,"
+        "bit_rate,duration,channels,sample_rate"
+        ":stream_tags=rotate:stream_side_data=rotation"
+        ":format=duration,bit_rate,format_name"
+        ":packet=stream_index,pts_time,flags",
         "-of",
         "json",
         path,
     ]
     result = _run_command(command)
     if result.returncode != 0:
-        return None, None
+        return None
     data = json.loads(result.stdout)
-    streams = data.get("streams", [])
-    if not streams:
+    format_info = data.get("format", {})
+    media = {
+        "format_name": format_info.get("format_name"),
+        "duration": _to_float(format_info.get("duration")),
+        "bit_rate": _to_int(format_info.get("bit_rate")),
+        "video": None,
+        "audio": [],
+    }
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and media["video"] is None:
+            media["video"] = {
+                "index": stream.get("index"),
+                "codec": stream.get("codec_name"),
+                "pix_fmt": stream.get("pix_fmt"),
+                "width": stream.get("width"),
+                "height": stream.get("height"),
+                "fps": _frame_rate(stream.get("avg_frame_rate")) or _frame_rate(stream.get("r_frame_rate")),
+                "bit_rate": _to_int(stream.get("bit_rate")),
+                "rotation": _rotation(stream),
+                "keyframe_interval": _keyframe_interval(data.get("packets", []), stream.get("index")),
+            }
+            if media["duration"] is None:
+                media["duration"] = _to_float(stream.get("duration"))
+        elif stream.get("codec_type") == "audio":
+            media["audio"].append(
+                {
+                    "index": stream.get("index"),
+                    "codec": stream.get("codec_name"),
+                    "channels": stream.get("channels"),
+                    "sample_rate": _to_int(stream.get("sample_rate")),
+                    "bit_rate": _to_int(stream.get("bit_rate")),
+                }
+            )
+    return media
+
+
+def media_resolution(media: Optional[dict]) -> Optional[str]:
+    video = (media or {}).get("video") or {}
+    width = video.get("width")
+    height = video.get("height")
+    return f"{width}x{height}" if width and height else None
+
+
+def get_video_info(path: str) -> Tuple[Optional[str], Optional[float]]:
+    media = probe_media(path)
+    if not media or not media.get("video"):
         return None, None
-    stream = streams[0]
-    width = stream.get("width")
-    height = stream.get("height")
-    duration = stream.get("duration")
-    if not duration:
-        format_info = data.get("format", {})
-        duration = format_info.get("duration")
-    resolution = f"{width}x{height}" if width and height else None
-    duration_seconds = float(duration) if duration else None
-    return resolution, duration_seconds
-
-
-def generate_thumbnail(input_path: str, video_id: int) -> Optional[str]:
-    ensure_ffmpeg_tools()
-    ensure_storage_dirs()
-    output_path = THUMBNAILS_DIR / f"{video_id}.jpg"
-    command = [
-        "ffmpeg",
-        "-y",
-        "-i",
-        input_path,
-        "-ss",
-        "00:00:01.000",
-        "-vframes",
-        "1",
-        str(output_path),
-    ]
-    result = _run_command(command)
-    return str(output_path) if result.returncode == 0 else None
+    return media_resolution(media), media.get("duration")
 
 
-def generate_preview_clip(input_path: str, video_id: int) -> Optional[str]:
-    ensure_ffmpeg_tools()
-    ensure_storage_dirs()
-    output_path = PREVIEWS_DIR / f"{video_id}.mp4"
-    command = [
-        "ffmpeg",
-        "-y",
-        "-i",
-        input_path,
-        "-t",
-        "5",
+PREVIEW_SECONDS = 5
+SPRITE_TILE_WIDTH = 160
+
+
+def build_assets_command(
+    input_path: str,
+    thumbnail_path: str,
+    preview_path: str,
+    duration: Optional[float] = None,
+    sprite_path: Optional[str] = None,
+    sprite_frames: int = 0,
+) -> list:
+    # Clips shorter than a second would otherwise produce no frame at all.
+    seek = min(1.0, duration / 2) if duration else 1.0
+    command = ["ffmpeg", "-y", "-t", str(PREVIEW_SECONDS), "-i", input_path]
+    filters = [
+        "[0:v]split=2[preview][thumbsrc]",
+        f"[thumbsrc]trim=start={seek:.3f},setpts=PTS-STARTPTS[thumb]",
+    ]
+    with_sprite = bool(sprite_path and sprite_frames > 0 and duration)
+    if with_sprite:
+        # One input per sprite frame, each seeked on the input side so ffmpeg
+        # jumps to the nearest keyframe instead of decoding up to the timestamp.
+        for index in range(sprite_frames):
+            timestamp = duration * (index + 0.5) / sprite_frames
+            command += ["-ss", f"{timestamp:.3f}", "-t", "1", "-i", input_path]
+            filters.append(
+                f"[{index + 1}:v]trim=end_frame=1,scale={SPRITE_TILE_WIDTH}:-2,setpts=PTS-STARTPTS[s{index}]"
+            )
+        columns = math.ceil(math.sqrt(sprite_frames))
+        rows = math.ceil(sprite_frames / columns)
+        labels = "".join(f"[s{index}]" for index in range(sprite_frames))
+        filters.append(f"{labels}concat=n={sprite_frames}:v=1:a=0,tile={columns}x{rows}[sprite]")
+    command += ["-filter_complex", ";".join(filters)]
+    command += ["-map", "[thumb]", "-frames:v", "1", thumbnail_path]
+    command += [
+        "-map",
+        "[preview]",
+        "-map",
+        "0:a?",
         "-c:v",
         "libx264",
         "-pix_fmt",
@@ -88,10 +200,118 @@ def generate_preview_clip(input_path: str, video_id: int) -> Optional[str]:
         "aac",
         "-movflags",
         "+faststart",
-        str(output_path),
+        preview_path,
     ]
+    if with_sprite:
+        command += ["-map", "[sprite]", "-frames:v", "1", sprite_path]
+    return command
+
+
+def generate_video_assets(
+    input_path: str,
+    video_id: int,
+    duration: Optional[float] = None,
+    sprite_frames: int = 0,
+) -> Dict[str, Optional[str]]:
+    """Write the thumbnail, preview clip and optional sprite sheet in one ffmpeg run.
+
+    Any failing output fails the whole run, and the sprite's many seeks are
+    the likeliest cause, so a failed run with a sprite is retried without it
+    rather than losing the thumbnail and preview as well.
+    """
+    ensure_ffmpeg_tools()
+    ensure_storage_dirs()
+    outputs = {
+        "thumbnail": str(THUMBNAILS_DIR / f"{video_id}.jpg"),
+        "preview": str(PREVIEWS_DIR / f"{video_id}.mp4"),
+        "sprite": str(SPRITES_DIR / f"{video_id}.jpg") if sprite_frames > 0 and duration else None,
+    }
+    command = build_assets_command(
+        input_path,
+        outputs["thumbnail"],
+        outputs["preview"],
+        duration,
+        outputs["sprite"],
+        sprite_frames,
+    )
     result = _run_command(command)
-    return str(output_path) if result.returncode == 0 else None
+    if result.returncode != 0 and outputs["sprite"]:
+        Path(outputs["sprite"]).unlink(missing_ok=True)
+        outputs["sprite"] = None
+        result = _run_command(build_assets_command(input_path, outputs["thumbnail"], outputs["preview"], duration))
+    if result.returncode != 0:
+        return {name: None for name in outputs}
+    return {name: path if path and Path(path).exists() else None for name, path in outputs.items()}
+
+
+FORMAT_DEFAULTS = {
+    "mp4": {"video": "libx264", "audio": "aac", "pix_fmt": "yuv420p"},
+    "mov": {"video": "libx264", "audio": "aac", "pix_fmt": "yuv420p"},
+    "mkv": {"video": "libx264", "audio": "aac", "pix_fmt": "yuv420p"},
+    "avi": {"video": "libx264", "audio": "aac", "pix_fmt": "yuv420p"},
+    "webm": {"video": "libvpx-vp9", "audio": "libopus", "pix_fmt": None},
+}
+
+
+def format_defaults(target_format: str) -> Dict[str, Optional[str]]:
+    return FORMAT_DEFAULTS.get(target_format, {"video": None, "audio": None, "pix_fmt": None})
+
+
+DEFAULT_ENCODER_PROFILE = "balanced"
+# Per-encoder speed/quality trade-offs. "crf" is only used when no explicit
+# bitrate was requested; an explicit bitrate always wins.
+ENCODER_PROFILES = {
+    "libx264": {
+        "fast": {"options": ["-preset", "veryfast", "-tune", "fastdecode"], "crf": 23},
+        "balanced": {"options": ["-preset", "fast"], "crf": 22},
+        "archive": {"options": ["-preset", "slow"], "crf": 18},
+    },
+    "libx265": {
+        "fast": {"options": ["-preset", "veryfast"], "crf": 28},
+        "balanced": {"options": ["-preset", "fast"], "crf": 26},
+        "archive": {"options": ["-preset", "slow"], "crf": 22},
+    },
+    # libvpx defaults to its slowest "good" settings with single-threaded
+    # rows, which is what made webm output impractical on CPU-only hosts.
+    "libvpx-vp9": {
+        "fast": {
+            "options": ["-deadline", "realtime", "-cpu-used", "8", "-row-mt", "1", "-tile-columns", "2"],
+            "crf": 36,
+        },
+        "balanced": {
+            "options": ["-deadline", "good", "-cpu-used", "4", "-row-mt", "1", "-tile-columns", "2"],
+            "crf": 33,
+        },
+        "archive": {
+            "options": ["-deadline", "good", "-cpu-used", "1", "-row-mt", "1", "-tile-columns", "1"],
+            "crf": 30,
+        },
+    },
+}
+ENCODER_PROFILE_NAMES = ("fast", "balanced", "archive")
+
+
+def encoder_options(
+    codec: Optional[str],
+    encoder_profile: Optional[str],
+    constant_quality: bool,
+    threads: Optional[int] = None,
+) -> list:
+    tuned = ENCODER_PROFILES.get(codec or "", {}).get(encoder_profile or DEFAULT_ENCODER_PROFILE)
+    options = []
+    if tuned:
+        options += tuned["options"]
+        if constant_quality:
+            options += ["-crf", str(tuned["crf"])]
+            if codec == "libvpx-vp9":
+                # Without a zero bitrate libvpx treats -crf as constrained quality.
+                options += ["-b:v", "0"]
+    if threads:
+        options += ["-threads", str(threads)]
+        if codec == "libx265":
+            # x265 sizes its own thread pool and ignores -threads.
+            options += ["-x265-params", f"pools={threads}"]
+    return options
 
 
 def build_conversion_command(
@@ -104,30 +324,34 @@ def build_conversion_command(
     target_codec: Optional[str],
     keep_audio: bool,
     clean_metadata: bool,
+    plan: Optional[Dict[str, str]] = None,
+    encoder_profile: Optional[str] = None,
+    threads: Optional[int] = None,
 ) -> list:
-    format_defaults = {
-        "mp4": {"video": "libx264", "audio": "aac", "pix_fmt": "yuv420p"},
-        "mov": {"video": "libx264", "audio": "aac", "pix_fmt": "yuv420p"},
-        "mkv": {"video": "libx264", "audio": "aac", "pix_fmt": "yuv420p"},
-        "avi": {"video": "libx264", "audio": "aac", "pix_fmt": "yuv420p"},
-        "webm": {"video": "libvpx-vp9", "audio": "libopus", "pix_fmt": None},
-    }
-    defaults = format_defaults.get(target_format, {"video": None, "audio": None, "pix_fmt": None})
+    defaults = format_defaults(target_format)
+    copy_video = bool(plan) and plan.get("video") == "copy"
+    copy_audio = bool(plan) and plan.get("audio") == "copy"
+    no_audio = not keep_audio or (bool(plan) and plan.get("audio") == "none")
     command = ["ffmpeg", "-y", "-i", input_path]
-    if target_resolution:
-        command += ["-vf", f"scale={target_resolution}"]
-    if target_fps:
-        command += ["-r", target_fps]
-    if target_bitrate:
-        command += ["-b:v", target_bitrate]
-    if target_codec:
-        command += ["-c:v", target_codec]
-    elif defaults["video"]:
-        command += ["-c:v", defaults["video"]]
-    if defaults["pix_fmt"]:
-        command += ["-pix_fmt", defaults["pix_fmt"]]
-    if not keep_audio:
+    if copy_video:
+        command += ["-c:v", "copy"]
+    else:
+        if target_resolution:
+            command += ["-vf", f"scale={target_resolution}"]
+        if target_fps:
+            command += ["-r", target_fps]
+        if target_bitrate:
+            command += ["-b:v", target_bitrate]
+        video_codec = target_codec or defaults["video"]
+        if video_codec:
+            command += ["-c:v", video_codec]
+        command += encoder_options(video_codec, encoder_profile, not target_bitrate, threads)
+        if defaults["pix_fmt"]:
+            command += ["-pix_fmt", defaults["pix_fmt"]]
+    if no_audio:
         command += ["-an"]
+    elif copy_audio:
+        command += ["-c:a", "copy"]
     elif defaults["audio"]:
         command += ["-c:a", defaults["audio"]]
     if clean_metadata:
@@ -138,6 +362,175 @@ def build_conversion_command(
     return command
 
 
+# Encoders whose ffmpeg wrappers implement -pass/-passlogfile; others fall
+# back to single-pass ABR at the computed bitrate.
+TWO_PASS_CODECS = {"libx264", "libvpx", "libvpx-vp9"}
+TARGET_SIZE_AUDIO_KBPS = 128
+# Headroom for container overhead and rate-control overshoot.
+TARGET_SIZE_MARGIN = 0.97
+MIN_TARGET_VIDEO_KBPS = 32
+
+
+def target_size_bitrate(
+    target_size_mb: float,
+    duration: Optional[float],
+    audio_kbps: float = 0,
+) -> str:
+    """Video bitrate that makes ``duration`` seconds fit in ``target_size_mb`` (10^6 bytes)."""
+    if not duration or duration <= 0:
+        raise ValueError("Target size needs a known duration")
+    total_kbps = target_size_mb * 8000 * TARGET_SIZE_MARGIN / duration
+    video_kbps = int(total_kbps - audio_kbps)
+    if video_kbps < MIN_TARGET_VIDEO_KBPS:
+        raise ValueError("Target size is too small for this duration")
+    return f"{video_kbps}k"
+
+
+def target_size_audio_kbps(media: Optional[dict], plan: Optional[Dict[str, str]]) -> float:
+    if plan and plan.get("audio") == "none":
+        return 0
+    if plan and plan.get("audio") == "copy":
+        streams = (media or {}).get("audio") or []
+        bit_rate = streams[0].get("bit_rate") if streams else None
+        return bit_rate / 1000 if bit_rate else TARGET_SIZE_AUDIO_KBPS
+    return TARGET_SIZE_AUDIO_KBPS
+
+
+def passlog_prefix(
+    source_key: str,
+    target_format: str,
+    target_resolution: Optional[str],
+    target_fps: Optional[str],
+    target_codec: Optional[str],
+    encoder_profile: Optional[str],
+) -> Path:
+    """Stats file prefix shared by every size requested for the same encode.
+
+    Pass 1 only depends on the decoded frames and encoder settings, not on
+    the final bitrate, so re-requests at other sizes go straight to pass 2.
+    """
+    video_codec = target_codec or format_defaults(target_format)["video"]
+    payload = json.dumps(
+        [source_key, video_codec, target_resolution, target_fps, encoder_profile or DEFAULT_ENCODER_PROFILE],
+        separators=(",", ":"),
+    )
+    return PASSLOGS_DIR / hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def passlog_ready(prefix: Path) -> bool:
+    log = Path(f"{prefix}-0.log")
+    try:
+        # Touched on every lookup so pruning drops the least recently used sets.
+        os.utime(log)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def prune_passlogs() -> int:
+    """Delete least recently used pass-1 log sets beyond ``passlog_cache_mb``.
+
+    Sets still being written (``<prefix>.<conversion id>``) belong to running
+    jobs and are left alone; those jobs remove them when they finish.
+    """
+    sets: Dict[str, List[Path]] = {}
+    for path in PASSLOGS_DIR.glob("*"):
+        name = path.name.split("-", 1)[0]
+        if "." not in name:
+            sets.setdefault(name, []).append(path)
+    usage = {}
+    for name, paths in sets.items():
+        stats = [path.stat() for path in paths if path.exists()]
+        usage[name] = (max((stat.st_mtime for stat in stats), default=0.0), sum(stat.st_size for stat in stats))
+    total = sum(size for _, size in usage.values())
+    limit = settings.passlog_cache_mb * 1024 * 1024
+    removed = 0
+    for name in sorted(usage, key=lambda key: usage[key][0]):
+        if total <= limit:
+            break
+        for path in sets[name]:
+            path.unlink(missing_ok=True)
+        total -= usage[name][1]
+        removed += 1
+    return removed
+
+
+def publish_passlog(temporary_prefix: Path, prefix: Path) -> None:
+    # The .log file is renamed last because its presence marks the set complete.
+    logs = sorted(
+        PASSLOGS_DIR.glob(f"{temporary_prefix.name}-*"),
+        key=lambda path: path.suffix == ".log",
+    )
+    for path in logs:
+        os.replace(path, PASSLOGS_DIR / path.name.replace(temporary_prefix.name, prefix.name, 1))
+
+
+def build_two_pass_commands(
+    input_path: str,
+    output_path: str,
+    target_format: str,
+    target_resolution: Optional[str],
+    target_bitrate: str,
+    target_fps: Optional[str],
+    target_codec: Optional[str],
+    keep_audio: bool,
+    clean_metadata: bool,
+    plan: Optional[Dict[str, str]],
+    encoder_profile: Optional[str],
+    threads: Optional[int],
+    pass1_prefix: Path,
+    pass2_prefix: Path,
+) -> Tuple[Optional[list], list]:
+    """Return (pass 1, pass 2) commands; pass 1 is None if the codec is single-pass."""
+    video_codec = target_codec or format_defaults(target_format)["video"]
+    final = build_conversion_command(
+        input_path,
+        output_path,
+        target_format,
+        target_resolution,
+        target_bitrate,
+        target_fps,
+        target_codec,
+        keep_audio,
+        clean_metadata,
+        plan,
+        encoder_profile,
+        threads,
+    )
+    if plan and plan.get("audio") == "encode":
+        final = final[:-1] + ["-b:a", f"{TARGET_SIZE_AUDIO_KBPS}k", final[-1]]
+    if video_codec not in TWO_PASS_CODECS:
+        return None, final
+    first = ["ffmpeg", "-y", "-i", input_path]
+    if target_resolution:
+        first += ["-vf", f"scale={target_resolution}"]
+    if target_fps:
+        first += ["-r", target_fps]
+    first += ["-b:v", target_bitrate, "-c:v", video_codec]
+    first += encoder_options(video_codec, encoder_profile, False, threads)
+    if format_defaults(target_format)["pix_fmt"]:
+        first += ["-pix_fmt", format_defaults(target_format)["pix_fmt"]]
+    first += ["-pass", "1", "-passlogfile", str(pass1_prefix), "-an", "-f", "null", os.devnull]
+    final = final[:-1] + ["-pass", "2", "-passlogfile", str(pass2_prefix), final[-1]]
+    return first, final
+
+
+def build_multi_output_command(input_path: str, commands: List[list]) -> list:
+    """Merge single-output commands into one ffmpeg run that decodes the input once.
+
+    Output options are positional in ffmpeg (they apply to the next output
+    file), so the per-output tails of ``build_conversion_command`` can simply
+    be concatenated after a shared input.
+    """
+    prefix = ["ffmpeg", "-y", "-i", input_path]
+    command = list(prefix)
+    for single in commands:
+        if single[: len(prefix)] != prefix:
+            raise ValueError("Commands must share the same input")
+        command += single[len(prefix) :]
+    return command
+
+
 def convert_video(
     input_path: str,
     conversion_id: int,
@@ -148,9 +541,28 @@ def convert_video(
     target_codec: Optional[str],
     keep_audio: bool,
     clean_metadata: bool,
+    plan: Optional[Dict[str, str]] = None,
+    media: Optional[dict] = None,
+    encoder_profile: Optional[str] = None,
+    threads: Optional[int] = None,
 ) -> Tuple[str, subprocess.Popen]:
     ensure_ffmpeg_tools()
     ensure_storage_dirs()
+    if target_format == HLS_FORMAT:
+        output_dir = hls_output_dir(conversion_id)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        output_dir.mkdir(parents=True)
+        video_info = (media or {}).get("video") or {}
+        command = build_hls_command(
+            input_path,
+            str(output_dir),
+            video_info.get("height"),
+            keep_audio and bool((media or {}).get("audio", True)),
+            clean_metadata,
+            encoder_profile,
+            threads,
+        )
+        return str(output_dir / HLS_MASTER_PLAYLIST), start_with_progress(command, conversion_id)
     output_path = CONVERTED_DIR / f"{conversion_id}.{target_format}"
     command = build_conversion_command(
         input_path,
@@ -162,12 +574,179 @@ def convert_video(
         target_codec,
         keep_audio,
         clean_metadata,
+        plan,
+        encoder_profile,
+        threads,
     )
+    return str(output_path), start_with_progress(command, conversion_id)
+
+
+def with_progress_pipe(command: list) -> list:
+    # Machine-readable key=value progress on stdout; stderr keeps only errors.
+    return [command[0], "-progress", "pipe:1", "-nostats", "-loglevel", "error", *command[1:]]
+
+
+def start_with_progress(command: list, conversion_id: Optional[int] = None) -> subprocess.Popen:
+    # A new session gives ffmpeg its own process group that can be signalled
+    # (cancel, suspend) without touching the server.
     process = subprocess.Popen(
-        command,
+        limited(with_progress_pipe(command)),
         stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
+        stderr=subprocess.PIPE,
         text=True,
         bufsize=1,
+        start_new_session=True,
+    )
+    if conversion_id is not None:
+        registry.add(conversion_id, process)
+    return process
+
+
+HLS_FORMAT = "hls"
+HLS_SEGMENT_SECONDS = 6
+HLS_MASTER_PLAYLIST = "master.m3u8"
+# (height, video bitrate, max rate, audio bitrate), tallest first.
+HLS_LADDER = [
+    (1080, "5000k", "5350k", "192k"),
+    (720, "2800k", "2996k", "128k"),
+    (480, "1400k", "1498k", "96k"),
+]
+
+
+def hls_ladder(source_height: Optional[int]) -> List[tuple]:
+    # Never upscale; a source smaller than every rung still gets the lowest one.
+    rungs = [rung for rung in HLS_LADDER if not source_height or rung[0] <= source_height]
+    return rungs or HLS_LADDER[-1:]
+
+
+def hls_output_dir(conversion_id: int) -> Path:
+    return CONVERTED_DIR / f"{conversion_id}_hls"
+
+
+def remove_conversion_output(conversion_id: int, target_format: str) -> None:
+    if target_format == HLS_FORMAT:
+        shutil.rmtree(hls_output_dir(conversion_id), ignore_errors=True)
+        return
+    (CONVERTED_DIR / f"{conversion_id}.{target_format}").unlink(missing_ok=True)
+
+
+def build_hls_command(
+    input_path: str,
+    output_dir: str,
+    source_height: Optional[int],
+    has_audio: bool,
+    clean_metadata: bool,
+    encoder_profile: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> list:
+    """Encode every rung of the ladder from a single decode via the split filter."""
+    rungs = hls_ladder(source_height)
+    labels = "".join(f"[v{index}]" for index in range(len(rungs)))
+    filters = [f"[0:v]split={len(rungs)}{labels}"]
+    filters += [f"[v{index}]scale=-2:{height}[v{index}out]" for index, (height, *_rest) in enumerate(rungs)]
+    command = ["ffmpeg", "-y", "-i", input_path, "-filter_complex", ";".join(filters)]
+    for index, (_height, bitrate, maxrate, _audio_bitrate) in enumerate(rungs):
+        command += [
+            "-map",
+            f"[v{index}out]",
+            f"-c:v:{index}",
+            "libx264",
+            f"-b:v:{index}",
+            bitrate,
+            f"-maxrate:v:{index}",
+            maxrate,
+            f"-bufsize:v:{index}",
+            bitrate,
+        ]
+    if has_audio:
+        for index, (*_rest, audio_bitrate) in enumerate(rungs):
+            command += ["-map", "0:a:0", f"-c:a:{index}", "aac", f"-b:a:{index}", audio_bitrate]
+    stream_map = " ".join(
+        f"v:{index},a:{index}" if has_audio else f"v:{index}" for index in range(len(rungs))
     )
-    return str(output_path), process
+    # The ladder is bitrate-driven, so the profile only picks the preset; the
+    # thread budget is shared by the rungs' encoders.
+    rung_threads = max(1, threads // len(rungs)) if threads else None
+    command += encoder_options("libx264", encoder_profile, False, rung_threads)
+    command += [
+        "-pix_fmt",
+        "yuv420p",
+        # Identical keyframe positions in every rung let players switch at segment edges.
+        "-force_key_frames",
+        f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-sc_threshold",
+        "0",
+    ]
+    if clean_metadata:
+        command += ["-map_metadata", "-1"]
+    command += [
+        "-f",
+        "hls",
+        "-hls_time",
+        str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type",
+        "vod",
+        "-hls_segment_filename",
+        f"{output_dir}/v%v/segment_%05d.ts",
+        "-master_pl_name",
+        HLS_MASTER_PLAYLIST,
+        "-var_stream_map",
+        stream_map,
+        f"{output_dir}/v%v/index.m3u8",
+    ]
+    return command
+
+
+def build_split_command(input_path: str, segment_pattern: str, segment_times: List[float]) -> list:
+    # Stream copy cuts on the first keyframe at or after each requested time,
+    # so every segment starts with a keyframe and decodes independently.
+    return [
+        "ffmpeg",
+        "-y",
+        "-i",
+        input_path,
+        "-map",
+        "0:v:0",
+        "-c",
+        "copy",
+        "-f",
+        "segment",
+        "-segment_times",
+        ",".join(f"{time:.3f}" for time in segment_times),
+        "-reset_timestamps",
+        "1",
+        segment_pattern,
+    ]
+
+
+def build_concat_command(
+    list_path: str,
+    input_path: str,
+    output_path: str,
+    target_format: str,
+    keep_audio: bool,
+    clean_metadata: bool,
+    plan: Optional[Dict[str, str]] = None,
+) -> list:
+    # Audio is taken from the original in a single pass so there are no
+    # encoder priming gaps at segment boundaries.
+    defaults = format_defaults(target_format)
+    command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-i", input_path]
+    command += ["-map", "0:v:0", "-c:v", "copy"]
+    no_audio = not keep_audio or (bool(plan) and plan.get("audio") == "none")
+    if no_audio:
+        command += ["-an"]
+    else:
+        command += ["-map", "1:a:0?"]
+        if bool(plan) and plan.get("audio") == "copy":
+            command += ["-c:a", "copy"]
+        elif defaults["audio"]:
+            command += ["-c:a", defaults["audio"]]
+    if clean_metadata:
+        command += ["-map_metadata", "-1"]
+    else:
+        command += ["-map_metadata", "1"]
+    if target_format in {"mp4", "mov"}:
+        command += ["-movflags", "+faststart"]
+    command += [output_path]
+    return command
@@ -1,18 +1,214 @@
+import base64
+import io
+import multiprocessing
+import os
+import resource
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Sequence, Tuple
 
 from PIL import Image as PilImage
+from PIL import ImageOps, ImageSequence
 
+from app.core.config import settings
 from app.services.storage import (
     IMAGE_CONVERTED_DIR,
     IMAGE_ORIGINALS_DIR,
+    IMAGE_THUMBNAILS_DIR,
     ensure_storage_dirs,
 )
 
 
-def get_image_info(path: str) -> Optional[str]:
+# Decode/resample at least this many times the target size before the final
+# LANCZOS pass; 2.0 is visually indistinguishable from a full-size resample.
+REDUCING_GAP = 2.0
+
+THUMBNAIL_SIZE = (320, 320)
+PLACEHOLDER_SIZE = (16, 16)
+# Niceness of the upload-time preview worker, below on-demand conversions.
+BACKGROUND_NICE = 10
+EXIF_ORIENTATION = 0x0112
+# Formats Pillow can write as animations; others keep the first frame.
+ANIMATED_FORMATS = {"webp", "png"}
+MB = 1024 * 1024
+
+# Pillow's own decompression-bomb guard, tightened to our configured limit.
+PilImage.MAX_IMAGE_PIXELS = settings.image_max_pixels
+
+_pool: Optional[ProcessPoolExecutor] = None
+_background_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def image_worker_count() -> int:
+    if settings.image_workers > 0:
+        return settings.image_workers
+    return os.cpu_count() or 1
+
+
+def _new_pool(workers: int, initializer: Optional[Callable] = None) -> ProcessPoolExecutor:
+    # forkserver children start clean instead of inheriting the server's
+    # threads and locks the way fork would.
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initializer)
+
+
+def _lower_priority() -> None:
+    os.nice(BACKGROUND_NICE)
+
+
+def image_pool() -> ProcessPoolExecutor:
+    """Process pool for Pillow work, so decode/resize/encode never hold the server's GIL."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool(image_worker_count())
+        return _pool
+
+
+def background_image_pool() -> ProcessPoolExecutor:
+    """A single niced worker for speculative work such as upload-time previews."""
+    global _background_pool
+    with _pool_lock:
+        if _background_pool is None:
+            _background_pool = _new_pool(1, _lower_priority)
+        return _background_pool
+
+
+def shutdown_image_pool() -> None:
+    global _pool, _background_pool
+    with _pool_lock:
+        for pool in (_pool, _background_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        _pool = _background_pool = None
+
+
+def _discard_pool(broken: ProcessPoolExecutor) -> None:
+    global _pool, _background_pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+        if _background_pool is broken:
+            _background_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(get_pool: Callable[[], ProcessPoolExecutor], func: Callable, *args) -> Future:
+    # A worker that dies mid-job (OOM kill, segfault) breaks the whole
+    # executor for good; replace it once instead of failing every later job.
+    pool = get_pool()
+    try:
+        return pool.submit(func, *args)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        return get_pool().submit(func, *args)
+
+
+def _reset_peak_rss() -> None:
+    # Writing 5 to clear_refs resets VmHWM (Linux 4.0+), making the peak per job
+    # rather than per worker lifetime.
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux and never resets, so this is an upper bound.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _measured(func: Callable, *args):
+    _reset_peak_rss()
+    result = func(*args)
+    return result, _peak_rss_mb()
+
+
+def submit_image_job(func: Callable, *args) -> Future:
+    """Run ``func`` in the image pool; the future yields ``(result, peak_rss_mb)``."""
+    return _submit(image_pool, _measured, func, *args)
+
+
+def submit_background_image_job(func: Callable, *args) -> Future:
+    return _submit(background_image_pool, func, *args)
+
+
+def parse_resolution(target_resolution: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not target_resolution:
+        return None
+    width_str, height_str = target_resolution.lower().split("x")
+    width, height = int(width_str), int(height_str)
+    if width < 1 or height < 1:
+        raise ValueError(f"Invalid target resolution: {target_resolution}")
+    return width, height
+
+
+def read_image_header(path: str) -> dict:
+    """Metadata available without decoding pixels.
+
+    ``PilImage.open`` only parses headers; EXIF, ICC and the frame count of
+    animated WebP/PNG come from container chunks, so this stays cheap even
+    for very large images.
+    """
     with PilImage.open(path) as image:
-        return f"{image.width}x{image.height}"
+        # PNG.getexif() decodes the whole image to find an eXIf chunk placed
+        # after the pixel data; a header-only read settles for the chunks seen so far.
+        if image.format == "PNG" and "exif" not in image.info:
+            orientation = 1
+        else:
+            orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        return {
+            "width": image.width,
+            "height": image.height,
+            "mode": image.mode,
+            "orientation": orientation,
+            "has_icc_profile": bool(image.info.get("icc_profile")),
+            "frame_count": getattr(image, "n_frames", 1),
+        }
+
+
+def get_image_info(path: str) -> Optional[str]:
+    header = read_image_header(path)
+    return f"{header['width']}x{header['height']}"
+
+
+def generate_image_previews(input_path: str, image_id: int) -> dict:
+    """Write a list-view thumbnail and return it with an inline placeholder.
+
+    The placeholder is a tiny WebP data URI (a few hundred bytes) that the
+    frontend can show blurred until the thumbnail loads.
+    """
+    ensure_storage_dirs()
+    thumbnail_path = IMAGE_THUMBNAILS_DIR / f"{image_id}.webp"
+    try:
+        with PilImage.open(input_path) as image:
+            image.draft(None, (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+            check_memory_budget(image)
+            thumbnail = ImageOps.exif_transpose(image)
+            thumbnail.thumbnail(THUMBNAIL_SIZE, PilImage.LANCZOS, reducing_gap=REDUCING_GAP)
+            if thumbnail.mode not in {"RGB", "RGBA"}:
+                thumbnail = thumbnail.convert("RGBA" if "A" in thumbnail.getbands() else "RGB")
+            thumbnail.save(thumbnail_path, format="WEBP", quality=80)
+            placeholder = thumbnail.copy()
+            placeholder.thumbnail(PLACEHOLDER_SIZE, PilImage.BILINEAR)
+            buffer = io.BytesIO()
+            placeholder.save(buffer, format="WEBP", quality=30)
+        encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+        return {"thumbnail": str(thumbnail_path), "placeholder": f"data:image/webp;base64,{encoded}"}
+    except Exception:
+        return {"thumbnail": None, "placeholder": None}
 
 
 def save_image_upload(upload_path: str, filename: str) -> str:
@@ -23,6 +219,87 @@ def save_image_upload(upload_path: str, filename: str) -> str:
     return str(destination)
 
 
+def check_memory_budget(
+    image: PilImage.Image,
+    output_size: Optional[Tuple[int, int]] = None,
+    frame_count: int = 1,
+    extra_outputs: Sequence[Tuple[int, int]] = (),
+) -> None:
+    """Refuse work whose decoded pixels would not fit the per-job budget.
+
+    Call after ``draft()``, so a JPEG that can be decoded at reduced scale is
+    measured at that scale. A static image counts the source plus the resized
+    ``output_size`` and any ``extra_outputs`` held alongside it.
+    """
+    pixels = image.width * image.height
+    if pixels > settings.image_max_pixels:
+        raise ValueError(
+            f"Image has {pixels / 1e6:.0f} MP, over the {settings.image_max_pixels / 1e6:.0f} MP limit"
+        )
+    bands = len(image.getbands())
+    needed = pixels * bands
+    for width, height in ([output_size] if output_size else []) + list(extra_outputs):
+        needed += width * height * bands
+    if frame_count > 1:
+        # One decoded RGBA source frame at a time, plus every output frame.
+        width, height = output_size or image.size
+        needed = pixels * 4 + width * height * 4 * frame_count
+    if needed / MB > settings.image_memory_budget_mb:
+        raise ValueError(
+            f"Decoding needs about {needed / MB:.0f} MB, over the {settings.image_memory_budget_mb} MB budget"
+        )
+
+
+def _quality(quality: Optional[int]) -> dict:
+    return {"quality": max(10, min(int(quality), 95))} if quality else {}
+
+
+def _save(image: PilImage.Image, output_path: Path, target_format: str, quality: Optional[int]) -> None:
+    save_kwargs = _quality(quality)
+    format_name = target_format.upper()
+    if target_format.lower() in {"jpg", "jpeg"}:
+        format_name = "JPEG"
+        save_kwargs["quality"] = save_kwargs.get("quality", 85)
+        image = image.convert("RGB")
+    image.save(output_path, format=format_name, **save_kwargs)
+
+
+def _save_animated(
+    source: PilImage.Image,
+    size: Optional[Tuple[int, int]],
+    output_path: Path,
+    target_format: str,
+    quality: Optional[int],
+) -> None:
+    """Re-encode every frame of an animated WebP/PNG.
+
+    Frames are decoded one at a time as the sequence is walked and resized
+    straight away, so only one full-size frame is ever held; Pillow's
+    animation writers still need the (resized) output frames up front.
+    """
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(source):
+        current = frame.convert("RGBA")
+        if size:
+            current = current.resize(size, PilImage.LANCZOS, reducing_gap=REDUCING_GAP)
+        frames.append(current)
+        durations.append(frame.info.get("duration", 100))
+    frames[0].save(
+        output_path,
+        format=target_format.upper(),
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=source.info.get("loop", 0),
+        **_quality(quality),
+    )
+
+
+def _is_animated(image: PilImage.Image, target_format: str) -> bool:
+    return getattr(image, "n_frames", 1) > 1 and target_format.lower() in ANIMATED_FORMATS
+
+
 def convert_image(
     input_path: str,
     conversion_id: int,
@@ -33,19 +310,82 @@ def convert_image(
     ensure_storage_dirs()
     output_path = IMAGE_CONVERTED_DIR / f"{conversion_id}.{target_format}"
     try:
+        size = parse_resolution(target_resolution)
         with PilImage.open(input_path) as image:
-            if target_resolution:
-                width_str, height_str = target_resolution.lower().split("x")
-                image = image.resize((int(width_str), int(height_str)), PilImage.LANCZOS)
-            save_kwargs = {}
-            if quality:
-                save_kwargs["quality"] = max(10, min(int(quality), 95))
-            format_name = target_format.upper()
-            if target_format.lower() in {"jpg", "jpeg"}:
-                format_name = "JPEG"
-                save_kwargs["quality"] = save_kwargs.get("quality", 85)
-                image = image.convert("RGB")
-            image.save(output_path, format=format_name, **save_kwargs)
+            if size:
+                # JPEG can decode straight at 1/2, 1/4 or 1/8 scale; other
+                # formats get an integer reduce() inside resize().
+                image.draft(None, (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP)))
+            if _is_animated(image, target_format):
+                check_memory_budget(image, size, image.n_frames)
+                _save_animated(image, size, output_path, target_format, quality)
+                return str(output_path), None
+            check_memory_budget(image, size)
+            if size:
+                image = image.resize(size, PilImage.LANCZOS, reducing_gap=REDUCING_GAP)
+            _save(image, output_path, target_format, quality)
         return str(output_path), None
     except Exception as exc:
         return "", str(exc)
+
+
+def convert_image_derivatives(input_path: str, outputs: List[dict]) -> List[Tuple[str, Optional[str]]]:
+    """Produce several (format, resolution, quality) variants from one decode.
+
+    ``outputs`` entries carry ``conversion_id``, ``target_format``,
+    ``target_resolution`` and ``quality``. Sizes are produced largest first and
+    each one is resampled from the smallest image already made that still
+    covers it, so a 320px variant comes from the 640px one, not the original.
+    Animated sources keep their animation for WebP/PNG outputs; those are
+    encoded frame by frame on their own. Results follow the order of ``outputs``.
+    """
+    ensure_storage_dirs()
+    results: List[Tuple[str, Optional[str]]] = [("", None)] * len(outputs)
+    try:
+        sizes = [parse_resolution(output["target_resolution"]) for output in outputs]
+    except ValueError as exc:
+        return [("", str(exc))] * len(outputs)
+    order = sorted(range(len(outputs)), key=lambda index: -(sizes[index][0] * sizes[index][1]) if sizes[index] else 0)
+    try:
+        with PilImage.open(input_path) as source:
+            animated = [index for index in order if _is_animated(source, outputs[index]["target_format"])]
+            for index in animated:
+                output = outputs[index]
+                output_path = IMAGE_CONVERTED_DIR / f"{output['conversion_id']}.{output['target_format']}"
+                try:
+                    check_memory_budget(source, sizes[index], source.n_frames)
+                    _save_animated(source, sizes[index], output_path, output["target_format"], output.get("quality"))
+                    results[index] = (str(output_path), None)
+                except Exception as exc:
+                    results[index] = ("", str(exc))
+            static = [index for index in order if index not in animated]
+            if not static:
+                return results
+            source.seek(0)
+            if all(sizes[index] for index in static):
+                largest = max((sizes[index] for index in static), key=lambda size: size[0] * size[1])
+                source.draft(None, (int(largest[0] * REDUCING_GAP), int(largest[1] * REDUCING_GAP)))
+            check_memory_budget(source, extra_outputs=[sizes[index] for index in static if sizes[index]])
+            source.load()
+            produced = [source]
+            for index in static:
+                output = outputs[index]
+                output_path = IMAGE_CONVERTED_DIR / f"{output['conversion_id']}.{output['target_format']}"
+                try:
+                    image = source
+                    if sizes[index]:
+                        width, height = sizes[index]
+                        base = min(
+                            (image for image in produced if image.width >= width and image.height >= height),
+                            key=lambda image: image.width * image.height,
+                            default=source,
+                        )
+                        image = base.resize(sizes[index], PilImage.LANCZOS, reducing_gap=REDUCING_GAP)
+                        produced.append(image)
+                    _save(image, output_path, output["target_format"], output.get("quality"))
+                    results[index] = (str(output_path), None)
+                except Exception as exc:
+                    results[index] = ("", str(exc))
+    except Exception as exc:
+        return [result if result[0] else ("", str(exc)) for result in results]
+    return results
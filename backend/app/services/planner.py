@@ -0,0 +1,74 @@
+from typing import Dict, Optional
+
+# Codecs each target container can carry without re-encoding. Copies into
+# mp4/mov/mkv/avi also require yuv420p video, matching what the encode path
+# forces with -pix_fmt so remuxed outputs play in the same places.
+CONTAINER_CODECS: Dict[str, Dict[str, set]] = {
+    "mp4": {
+        "video": {"h264", "hevc", "av1", "mpeg4"},
+        "audio": {"aac", "mp3", "ac3", "eac3", "alac", "opus", "flac"},
+    },
+    "mov": {
+        "video": {"h264", "hevc", "mpeg4", "prores", "mjpeg"},
+        "audio": {"aac", "mp3", "ac3", "alac", "pcm_s16le", "pcm_s24le"},
+    },
+    "mkv": {
+        "video": {"h264", "hevc", "av1", "vp8", "vp9", "mpeg4", "mpeg2video"},
+        "audio": {"aac", "mp3", "ac3", "eac3", "opus", "vorbis", "flac", "alac", "pcm_s16le"},
+    },
+    "avi": {
+        "video": {"h264", "mpeg4", "mjpeg"},
+        "audio": {"mp3", "ac3", "pcm_s16le"},
+    },
+    "webm": {
+        "video": {"vp8", "vp9", "av1"},
+        "audio": {"opus", "vorbis"},
+    },
+}
+
+YUV420_CONTAINERS = {"mp4", "mov", "mkv", "avi"}
+
+ENCODER_CODECS = {
+    "libx264": "h264",
+    "h264": "h264",
+    "libx265": "hevc",
+    "hevc": "hevc",
+    "libvpx": "vp8",
+    "libvpx-vp9": "vp9",
+    "vp9": "vp9",
+    "libaom-av1": "av1",
+    "libsvtav1": "av1",
+    "mpeg4": "mpeg4",
+}
+
+
+def plan_streams(
+    media: Optional[dict],
+    target_format: str,
+    target_resolution: Optional[str],
+    target_bitrate: Optional[str],
+    target_fps: Optional[str],
+    target_codec: Optional[str],
+    keep_audio: bool,
+) -> Dict[str, str]:
+    allowed = CONTAINER_CODECS.get(target_format, {"video": set(), "audio": set()})
+    plan = {"video": "encode", "audio": "encode" if keep_audio else "none"}
+
+    source = (media or {}).get("video")
+    if source and not (target_resolution or target_bitrate or target_fps):
+        codec = source.get("codec")
+        wanted = ENCODER_CODECS.get(target_codec, target_codec) if target_codec else None
+        pix_fmt_ok = target_format not in YUV420_CONTAINERS or source.get("pix_fmt") == "yuv420p"
+        if codec in allowed["video"] and (wanted is None or wanted == codec) and pix_fmt_ok:
+            plan["video"] = "copy"
+
+    audio_streams = (media or {}).get("audio") or []
+    if keep_audio and audio_streams and audio_streams[0].get("codec") in allowed["audio"]:
+        plan["audio"] = "copy"
+    elif keep_audio and not audio_streams:
+        plan["audio"] = "none"
+    return plan
+
+
+def describe_plan(plan: Dict[str, str]) -> str:
+    return ",".join(f"{stream}:{action}" for stream, action in plan.items())
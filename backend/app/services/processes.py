@@ -0,0 +1,246 @@
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from app.core.config import settings
+
+# Seconds between SIGTERM and SIGKILL for an ffmpeg that ignores the former.
+TERMINATE_GRACE_SECONDS = 5.0
+# Exit signals an allocation failure under RLIMIT_AS tends to end in. SIGKILL
+# is left out: it is also how cancel, timeout and the terminate grace end ffmpeg.
+_MEMORY_SIGNALS = {-signal.SIGABRT, -signal.SIGSEGV}
+
+
+def ffmpeg_cpus() -> List[int]:
+    """Cores ffmpeg may run on; the first ``ffmpeg_reserved_cores`` stay with the web tier."""
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    reserved = settings.ffmpeg_reserved_cores
+    if reserved <= 0 or len(cpus) <= reserved:
+        return cpus
+    return cpus[reserved:]
+
+
+@lru_cache(maxsize=1)
+def limit_prefix() -> tuple:
+    """Wrapper commands that apply the configured limits before ffmpeg execs.
+
+    Setting them in the child before exec (instead of from the parent after
+    spawn) means every ffmpeg thread inherits them. A wrapper whose binary is
+    missing is skipped rather than breaking conversions.
+    """
+    prefix: List[str] = []
+    if settings.ffmpeg_nice and shutil.which("nice"):
+        prefix += ["nice", "-n", str(settings.ffmpeg_nice)]
+    if settings.ffmpeg_ionice_class and shutil.which("ionice"):
+        prefix += ["ionice", "-c", str(settings.ffmpeg_ionice_class)]
+        if settings.ffmpeg_ionice_class == 2:
+            prefix += ["-n", str(settings.ffmpeg_ionice_level)]
+    if settings.ffmpeg_reserved_cores > 0 and shutil.which("taskset"):
+        cpus = ffmpeg_cpus()
+        if cpus:
+            prefix += ["taskset", "-c", ",".join(str(cpu) for cpu in cpus)]
+    if settings.ffmpeg_max_memory_mb > 0 and shutil.which("prlimit"):
+        prefix += ["prlimit", f"--as={settings.ffmpeg_max_memory_mb * 1024 * 1024}", "--"]
+    return tuple(prefix)
+
+
+def limited(command: list) -> list:
+    return [*limit_prefix(), *command]
+
+
+def failure_message(returncode: int, stderr_lines: List[str]) -> str:
+    last = stderr_lines[-1].strip() if stderr_lines else ""
+    out_of_memory = returncode in _MEMORY_SIGNALS or any(
+        "Cannot allocate memory" in line for line in stderr_lines
+    )
+    if settings.ffmpeg_max_memory_mb > 0 and out_of_memory:
+        return f"Memory limit of {settings.ffmpeg_max_memory_mb} MB exceeded" + (f": {last}" if last else "")
+    return last or f"ffmpeg exited with code {returncode}"
+
+
+def run_limited(command: list) -> subprocess.CompletedProcess:
+    """``subprocess.run`` under the resource limits and wall-clock timeout."""
+    timeout = settings.ffmpeg_timeout_seconds or None
+    try:
+        return subprocess.run(limited(command), capture_output=True, text=True, check=False, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return subprocess.CompletedProcess(command, -signal.SIGKILL, "", f"Timed out after {timeout:g} seconds")
+
+
+class _Job:
+    def __init__(self) -> None:
+        self.processes: List[subprocess.Popen] = []
+        self.cancelled: Set[int] = set()
+        self.interrupted = False
+        self.suspended = False
+        self.timed_out = False
+        # Timeout budget still unspent; the timer only runs while not suspended.
+        self.remaining: Optional[float] = None
+        self.armed_at = 0.0
+        self.timer: Optional[threading.Timer] = None
+
+
+def _signal(process: subprocess.Popen, signum: int) -> None:
+    if process.poll() is not None:
+        return
+    try:
+        # Each ffmpeg runs in its own session, so its pid is also its group id.
+        os.killpg(process.pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _terminate(process: subprocess.Popen) -> None:
+    _signal(process, signal.SIGCONT)
+    _signal(process, signal.SIGTERM)
+    timer = threading.Timer(TERMINATE_GRACE_SECONDS, _signal, args=(process, signal.SIGKILL))
+    timer.daemon = True
+    timer.start()
+
+
+class ProcessRegistry:
+    """Tracks the ffmpeg process groups that belong to each running job.
+
+    A job is opened by the worker for the conversion it claimed; batch
+    siblings encoded by the same ffmpeg run are linked to it, so cancelling
+    any of them reaches the shared processes. With ``ffmpeg_timeout_seconds``
+    set, a job that has run for that long is interrupted and flagged; time
+    spent suspended by preemption does not count.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._jobs: Dict[int, _Job] = {}
+
+    @contextmanager
+    def job(self, conversion_id: int) -> Iterator[None]:
+        job = _Job()
+        with self._lock:
+            self._jobs[conversion_id] = job
+            if settings.ffmpeg_timeout_seconds > 0:
+                job.remaining = settings.ffmpeg_timeout_seconds
+                self._arm(job)
+        try:
+            yield
+        finally:
+            with self._lock:
+                if job.timer:
+                    job.timer.cancel()
+                    job.timer = None
+                job.remaining = None
+                for key in [key for key, value in self._jobs.items() if value is job]:
+                    del self._jobs[key]
+
+    def link(self, conversion_id: int, others: Iterable[int]) -> None:
+        with self._lock:
+            job = self._jobs.get(conversion_id)
+            if job is not None:
+                for other in others:
+                    self._jobs[other] = job
+
+    def add(self, conversion_id: int, process: subprocess.Popen) -> None:
+        with self._lock:
+            job = self._jobs.get(conversion_id)
+            if job is None:
+                return
+            job.processes.append(process)
+            interrupted = job.interrupted
+            suspended = job.suspended
+        # A cancel that raced with the spawn still has to stop this process.
+        if interrupted:
+            _terminate(process)
+        elif suspended:
+            _signal(process, signal.SIGSTOP)
+
+    def cancel(self, conversion_id: int) -> bool:
+        with self._lock:
+            job = self._jobs.get(conversion_id)
+            if job is None:
+                return False
+            job.cancelled.add(conversion_id)
+        self._interrupt(job)
+        return True
+
+    def terminate(self, conversion_id: int) -> None:
+        """Stop the job's processes without flagging it interrupted.
+
+        For a job giving up on its own error, so it still fails rather than
+        being re-queued like a cancelled or shut-down one.
+        """
+        with self._lock:
+            job = self._jobs.get(conversion_id)
+            processes = list(job.processes) if job else []
+        for process in processes:
+            _terminate(process)
+
+    def interrupt_all(self) -> None:
+        with self._lock:
+            jobs = {id(job): job for job in self._jobs.values()}
+        for job in jobs.values():
+            self._interrupt(job)
+
+    def _arm(self, job: _Job) -> None:
+        # Called with the lock held.
+        job.armed_at = time.monotonic()
+        job.timer = threading.Timer(job.remaining, self._expire, args=(job,))
+        job.timer.daemon = True
+        job.timer.start()
+
+    def _expire(self, job: _Job) -> None:
+        with self._lock:
+            job.timed_out = True
+        self._interrupt(job)
+
+    def _interrupt(self, job: _Job) -> None:
+        with self._lock:
+            job.interrupted = True
+            processes = list(job.processes)
+        for process in processes:
+            _terminate(process)
+
+    def cancelled(self, conversion_id: int) -> Set[int]:
+        with self._lock:
+            job = self._jobs.get(conversion_id)
+            return set(job.cancelled) if job else set()
+
+    def interrupted(self, conversion_id: int) -> bool:
+        with self._lock:
+            job = self._jobs.get(conversion_id)
+            return bool(job and job.interrupted)
+
+    def timed_out(self, conversion_id: int) -> bool:
+        with self._lock:
+            job = self._jobs.get(conversion_id)
+            return bool(job and job.timed_out)
+
+    def suspend(self, conversion_id: int) -> bool:
+        return self._pause(conversion_id, True)
+
+    def resume(self, conversion_id: int) -> bool:
+        return self._pause(conversion_id, False)
+
+    def _pause(self, conversion_id: int, suspended: bool) -> bool:
+        with self._lock:
+            job = self._jobs.get(conversion_id)
+            if job is None:
+                return False
+            job.suspended = suspended
+            if suspended and job.timer:
+                job.timer.cancel()
+                job.timer = None
+                job.remaining = max(0.0, job.remaining - (time.monotonic() - job.armed_at))
+            elif not suspended and job.timer is None and job.remaining is not None:
+                self._arm(job)
+            processes = list(job.processes)
+        for process in processes:
+            _signal(process, signal.SIGSTOP if suspended else signal.SIGCONT)
+        return True
+
+
+registry = ProcessRegistry()
@@ -1,23 +1,196 @@
+import sqlite3
+import threading
 import time
-from typing import Dict, List
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
 
 from fastapi import HTTPException, Request, status
 
 from app.core.config import settings
 
-_rate_store: Dict[str, List[float]] = {}
+WINDOW_SECONDS = 60
+# Ceiling on tracked keys in memory; the least recently seen are dropped first.
+MAX_MEMORY_KEYS = 100_000
 
 
-def enforce_rate_limit(request: Request) -> None:
+def _window_state(state: Optional[Tuple[int, int, int]], index: int) -> Tuple[int, int]:
+    """(current, previous) counts for window ``index`` given a stored state."""
+    if state is None or state[0] < index - 1:
+        return 0, 0
+    if state[0] == index - 1:
+        return 0, state[1]
+    return state[1], state[2]
+
+
+def _allowed(current: int, previous: int, limit: int, now: float, window: int) -> bool:
+    # Sliding-window counter: the previous window counts in proportion to how
+    # much of it still overlaps the last ``window`` seconds.
+    overlap = 1 - (now % window) / window
+    return previous * overlap + current < limit
+
+
+class MemoryRateLimitBackend:
+    """Per-process counters; right for a single uvicorn worker.
+
+    ``hit`` checks every key and only counts the request against them when all
+    of them allow it, so a request refused on one key costs the others
+    nothing. Each key holds three integers. Keys are kept in last-seen order,
+    so those idle for two windows (whose counts can no longer matter) are
+    evicted from the front on every hit.
+    """
+
+    def __init__(self, max_keys: int = MAX_MEMORY_KEYS) -> None:
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+        self._windows: "OrderedDict[str, Tuple[int, int, int]]" = OrderedDict()
+
+    def hit(self, keys: Sequence[str], limit: int, window: int, now: float) -> bool:
+        index = int(now // window)
+        with self._lock:
+            states = [_window_state(self._windows.pop(key, None), index) for key in keys]
+            allowed = all(_allowed(current, previous, limit, now, window) for current, previous in states)
+            for key, (current, previous) in zip(keys, states):
+                self._windows[key] = (index, current + 1 if allowed else current, previous)
+            while self._windows:
+                oldest = next(iter(self._windows.values()))
+                if oldest[0] >= index - 1 and len(self._windows) <= self._max_keys:
+                    break
+                self._windows.popitem(last=False)
+        return allowed
+
+
+class SQLiteRateLimitBackend:
+    """Counters in a SQLite file shared by every worker process on the host.
+
+    Each hit is one ``BEGIN IMMEDIATE`` transaction over its keys' rows, so
+    the read-modify-write is atomic across processes. Rows idle for two
+    windows are deleted once per window.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._local = threading.local()
+        self._swept = 0
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits "
+                "(key TEXT PRIMARY KEY, window INTEGER NOT NULL, current INTEGER NOT NULL, previous INTEGER NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def hit(self, keys: Sequence[str], limit: int, window: int, now: float) -> bool:
+        index = int(now // window)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            states: List[Tuple[int, int]] = []
+            for key in keys:
+                row = connection.execute(
+                    "SELECT window, current, previous FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                states.append(_window_state(row, index))
+            allowed = all(_allowed(current, previous, limit, now, window) for current, previous in states)
+            connection.executemany(
+                "INSERT OR REPLACE INTO rate_limits (key, window, current, previous) VALUES (?, ?, ?, ?)",
+                [
+                    (key, index, current + 1 if allowed else current, previous)
+                    for key, (current, previous) in zip(keys, states)
+                ],
+            )
+            if self._swept != index:
+                self._swept = index
+                connection.execute("DELETE FROM rate_limits WHERE window < ?", (index - 1,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+# KEYS alternate current/previous window counters per client; ARGV is the
+# limit, the previous window's overlap weight and the counter TTL.
+_REDIS_HIT_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local overlap = tonumber(ARGV[2])
+for i = 1, #KEYS, 2 do
+    local current = tonumber(redis.call("GET", KEYS[i]) or "0")
+    local previous = tonumber(redis.call("GET", KEYS[i + 1]) or "0")
+    if previous * overlap + current >= limit then
+        return 0
+    end
+end
+for i = 1, #KEYS, 2 do
+    redis.call("INCR", KEYS[i])
+    redis.call("EXPIRE", KEYS[i], ARGV[3])
+end
+return 1
+"""
+
+
+class RedisRateLimitBackend:
+    """Counters in any Redis-protocol server, shared across hosts.
+
+    One key per client and window; the server expires them after two windows.
+    The check and the increments run as one Lua script, so concurrent workers
+    cannot all pass the check before any of them counts. Needs the optional
+    ``redis`` package.
+    """
+
+    def __init__(self, url: str) -> None:
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package") from exc
+        self._client = redis.Redis.from_url(url)
+        self._hit = self._client.register_script(_REDIS_HIT_SCRIPT)
+
+    def hit(self, keys: Sequence[str], limit: int, window: int, now: float) -> bool:
+        index = int(now // window)
+        names = [name for key in keys for name in (f"rl:{key}:{index}", f"rl:{key}:{index - 1}")]
+        overlap = 1 - (now % window) / window
+        return bool(self._hit(keys=names, args=[limit, overlap, window * 2]))
+
+
+def _create_backend():
+    backend = settings.rate_limit_backend.lower()
+    if backend == "sqlite":
+        return SQLiteRateLimitBackend(settings.rate_limit_url or str(Path(settings.storage_dir) / "rate_limit.db"))
+    if backend == "redis":
+        return RedisRateLimitBackend(settings.rate_limit_url or "redis://localhost:6379/0")
+    return MemoryRateLimitBackend()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def rate_limit_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+def enforce_rate_limit(request: Request, user_id: Optional[int] = None) -> None:
+    """Allow ``rate_limit_per_minute`` requests per client IP and per user."""
     limit = settings.rate_limit_per_minute
     if limit <= 0:
         return
     now = time.time()
-    window_start = now - 60
-    client_ip = request.client.host if request.client else "unknown"
-    timestamps = _rate_store.get(client_ip, [])
-    timestamps = [ts for ts in timestamps if ts >= window_start]
-    if len(timestamps) >= limit:
+    keys = [f"ip:{request.client.host if request.client else 'unknown'}"]
+    if user_id is not None:
+        keys.append(f"user:{user_id}")
+    if not rate_limit_backend().hit(keys, limit, WINDOW_SECONDS, now):
         raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded")
-    timestamps.append(now)
-    _rate_store[client_ip] = timestamps
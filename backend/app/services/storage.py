@@ -1,9 +1,14 @@
+import json
 import os
+import re
+import shutil
+import time
 import uuid
 from pathlib import Path
-from typing import Tuple
+from typing import BinaryIO, List, Optional, Tuple
 
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 
 from app.core.config import settings
 
@@ -13,9 +18,14 @@ ORIGINALS_DIR = STORAGE_ROOT / "originals"
 CONVERTED_DIR = STORAGE_ROOT / "converted"
 PREVIEWS_DIR = STORAGE_ROOT / "previews"
 THUMBNAILS_DIR = STORAGE_ROOT / "thumbnails"
+SPRITES_DIR = STORAGE_ROOT / "sprites"
+PASSLOGS_DIR = STORAGE_ROOT / "passlogs"
 CHUNKS_DIR = STORAGE_ROOT / "chunks"
 IMAGE_ORIGINALS_DIR = STORAGE_ROOT / "images" / "originals"
 IMAGE_CONVERTED_DIR = STORAGE_ROOT / "images" / "converted"
+IMAGE_THUMBNAILS_DIR = STORAGE_ROOT / "images" / "thumbnails"
+
+UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
 
 
 def ensure_storage_dirs() -> None:
@@ -24,9 +34,12 @@ def ensure_storage_dirs() -> None:
         CONVERTED_DIR,
         PREVIEWS_DIR,
         THUMBNAILS_DIR,
+        SPRITES_DIR,
+        PASSLOGS_DIR,
         CHUNKS_DIR,
         IMAGE_ORIGINALS_DIR,
         IMAGE_CONVERTED_DIR,
+        IMAGE_THUMBNAILS_DIR,
     ]:
         directory.mkdir(parents=True, exist_ok=True)
 
@@ -36,60 +49,173 @@ def generate_storage_name(filename: str) -> str:
     return f"{uuid.uuid4().hex}{ext}"
 
 
-async def save_upload_file_to_dir(upload_file: UploadFile, directory: Path) -> Tuple[str, int]:
-    ensure_storage_dirs()
-    storage_name = generate_storage_name(upload_file.filename)
-    destination = directory / storage_name
+def _buffer_size() -> int:
+    return max(64, settings.upload_buffer_kb) * 1024
+
+
+def _copy_to_file(
+    source: BinaryIO,
+    destination: Path,
+    mode: str = "wb",
+    offset: int = 0,
+    limit: Optional[int] = None,
+    digest=None,
+) -> int:
     size = 0
-    with destination.open("wb") as buffer:
+    buffer_size = _buffer_size()
+    with destination.open(mode) as buffer:
+        if offset:
+            buffer.seek(offset)
         while True:
-            chunk = await upload_file.read(1024 * 1024)
-            if not chunk:
+            block = source.read(buffer_size)
+            if not block:
                 break
-            size += len(chunk)
-            buffer.write(chunk)
+            if limit is not None and size + len(block) > limit:
+                raise ValueError("Chunk exceeds declared upload size")
+            buffer.write(block)
+            if digest is not None:
+                digest.update(block)
+            size += len(block)
+    return size
+
+
+async def save_upload_file_to_dir(upload_file: UploadFile, directory: Path, digest=None) -> Tuple[str, int]:
+    """Persist an upload without blocking the event loop.
+
+    By the time a handler runs, the multipart body has already been spooled
+    by Starlette, so the whole copy (and the optional ``hashlib`` ``digest``
+    update) runs as one job on the threadpool instead of one hop per block.
+    """
+    ensure_storage_dirs()
+    storage_name = generate_storage_name(upload_file.filename)
+    destination = directory / storage_name
+    await upload_file.seek(0)
+    size = await run_in_threadpool(_copy_to_file, upload_file.file, destination, "wb", 0, None, digest)
     return str(destination), size
 
 
-async def save_upload_file(upload_file: UploadFile) -> Tuple[str, int]:
-    return await save_upload_file_to_dir(upload_file, ORIGINALS_DIR)
+async def save_upload_file(upload_file: UploadFile, digest=None) -> Tuple[str, int]:
+    return await save_upload_file_to_dir(upload_file, ORIGINALS_DIR, digest)
 
 
-async def save_chunk(upload_id: str, chunk_index: int, chunk: UploadFile) -> str:
-    ensure_storage_dirs()
+def _upload_dir(upload_id: str) -> Path:
+    # upload_id ends up in a filesystem path, so only accept ids we minted.
+    if not UPLOAD_ID_RE.match(upload_id or ""):
+        raise FileNotFoundError("Upload not found")
     upload_dir = CHUNKS_DIR / upload_id
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    chunk_path = upload_dir / f"{chunk_index}.part"
-    with chunk_path.open("wb") as buffer:
-        while True:
-            data = await chunk.read(1024 * 1024)
-            if not data:
-                break
-            buffer.write(data)
-    return str(chunk_path)
-
-
-def assemble_chunks(upload_id: str, original_filename: str) -> Tuple[str, int]:
+    if not (upload_dir / "meta.json").exists():
+        raise FileNotFoundError("Upload not found")
+    return upload_dir
+
+
+def _last_activity(upload_dir: Path) -> float:
+    # Chunk writes touch data.bin and add markers under received/.
+    mtimes = []
+    for path in (upload_dir, upload_dir / "data.bin", upload_dir / "received"):
+        try:
+            mtimes.append(path.stat().st_mtime)
+        except OSError:
+            pass
+    return max(mtimes, default=0.0)
+
+
+def expire_stale_uploads() -> int:
+    """Remove resumable uploads with no activity for ``upload_ttl_hours``.
+
+    Each one holds a preallocated ``data.bin`` of its full size, so abandoned
+    uploads would otherwise fill the disk.
+    """
+    if settings.upload_ttl_hours <= 0 or not CHUNKS_DIR.exists():
+        return 0
+    cutoff = time.time() - settings.upload_ttl_hours * 3600
+    removed = 0
+    for upload_dir in CHUNKS_DIR.iterdir():
+        if upload_dir.is_dir() and _last_activity(upload_dir) < cutoff:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def create_upload(user_id: int, original_filename: str, total_size: int) -> str:
+    """Start a resumable upload and preallocate its target file.
+
+    Chunks are written straight into ``data.bin`` at their byte offset, so
+    they may arrive in any order or in parallel, and completion is a rename
+    rather than a second copy of every byte.
+    """
     ensure_storage_dirs()
+    expire_stale_uploads()
+    upload_id = uuid.uuid4().hex
     upload_dir = CHUNKS_DIR / upload_id
-    if not upload_dir.exists():
-        raise FileNotFoundError("Upload not found")
-    storage_name = generate_storage_name(original_filename)
-    destination = ORIGINALS_DIR / storage_name
-    size = 0
-    with destination.open("wb") as output:
-        for part in sorted(upload_dir.iterdir(), key=lambda p: int(p.stem)):
-            with part.open("rb") as input_file:
-                while True:
-                    data = input_file.read(1024 * 1024)
-                    if not data:
-                        break
-                    size += len(data)
-                    output.write(data)
-    for part in upload_dir.iterdir():
-        part.unlink()
-    upload_dir.rmdir()
-    return str(destination), size
+    (upload_dir / "received").mkdir(parents=True)
+    with (upload_dir / "data.bin").open("wb") as data:
+        data.truncate(total_size)
+    meta = {
+        "user_id": user_id,
+        "original_filename": original_filename,
+        "total_size": total_size,
+        "storage_name": generate_storage_name(original_filename),
+    }
+    (upload_dir / "meta.json").write_text(json.dumps(meta))
+    return upload_id
+
+
+def read_upload(upload_id: str) -> dict:
+    return json.loads((_upload_dir(upload_id) / "meta.json").read_text())
+
+
+def received_ranges(upload_id: str) -> List[Tuple[int, int]]:
+    # One empty marker file per stored chunk keeps concurrent writers (even
+    # across worker processes) from racing on a shared state file.
+    ranges = []
+    for marker in (_upload_dir(upload_id) / "received").iterdir():
+        start, _, end = marker.name.partition("-")
+        ranges.append((int(start), int(end)))
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def write_chunk(upload_id: str, offset: int, chunk: UploadFile) -> List[Tuple[int, int]]:
+    upload_dir = _upload_dir(upload_id)
+    total_size = read_upload(upload_id)["total_size"]
+    if offset < 0 or offset >= total_size:
+        raise ValueError("Chunk offset out of range")
+    await chunk.seek(0)
+    written = await run_in_threadpool(
+        _copy_to_file, chunk.file, upload_dir / "data.bin", "r+b", offset, total_size - offset
+    )
+    if written:
+        (upload_dir / "received" / f"{offset}-{offset + written}").touch()
+    return received_ranges(upload_id)
+
+
+def finish_upload(upload_id: str) -> Tuple[str, int]:
+    """Move a complete upload into ``ORIGINALS_DIR``.
+
+    Renaming the upload directory is the claim: of two concurrent calls only
+    one rename succeeds, and the other gets ``ValueError``.
+    """
+    try:
+        upload_dir = _upload_dir(upload_id)
+        meta = read_upload(upload_id)
+        total_size = meta["total_size"]
+        if received_ranges(upload_id) != [(0, total_size)]:
+            raise ValueError("Upload incomplete")
+        claimed = CHUNKS_DIR / f"{upload_id}.completing"
+        os.rename(upload_dir, claimed)
+    except FileNotFoundError:
+        raise ValueError("Upload already completed")
+    # Fresh mtime so the stale-upload sweep leaves it alone meanwhile.
+    os.utime(claimed)
+    destination = ORIGINALS_DIR / meta["storage_name"]
+    os.replace(claimed / "data.bin", destination)
+    shutil.rmtree(claimed, ignore_errors=True)
+    return str(destination), total_size
 
 
 def safe_filename(path: str) -> str:
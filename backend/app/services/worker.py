@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import func, or_
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.conversion import Conversion
+from app.services.processes import ffmpeg_cpus, registry
+
+
+def default_worker_count() -> int:
+    if settings.conversion_workers > 0:
+        return settings.conversion_workers
+    # libx264/libvpx already use several threads each, so one slot per two cores.
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def encoder_threads() -> int:
+    """Threads one conversion slot may give its encoder(s)."""
+    if settings.encoder_threads > 0:
+        return settings.encoder_threads
+    return max(1, (len(ffmpeg_cpus()) or os.cpu_count() or 1) // default_worker_count())
+
+
+# Missed heartbeats after which a "processing" row is considered orphaned.
+STALE_HEARTBEATS = 3
+
+
+class ConversionWorkerPool:
+    """Fixed pool of ffmpeg slots fed from the ``conversions`` table.
+
+    The table is the queue: rows in ``queued`` state are claimed with a
+    conditional UPDATE, so nothing is lost on restart. Each user's jobs run in
+    FIFO order, and a free slot always goes to the user with the fewest jobs
+    currently running, so one user's burst cannot starve everyone else.
+
+    Every process heartbeats the rows it is running; a ``processing`` row
+    whose heartbeat is older than ``STALE_HEARTBEATS`` intervals belonged to
+    a process that died and is re-queued by whichever process notices first,
+    so several API processes can serve one database.
+
+    An interactive job submitted with ``preempt=<its id>`` while every slot
+    is busy borrows a slot from a running batch job: that job's ffmpeg is
+    suspended with SIGSTOP while the submitted job (and only that one) runs,
+    and resumed afterwards, so no encoding work is lost.
+    """
+
+    def __init__(self, handler: Callable[[int], None], slots: Optional[int] = None) -> None:
+        self._handler = handler
+        self._slots = slots or default_worker_count()
+        self._condition = threading.Condition()
+        self._running: Dict[int, int] = {}
+        # conversion id -> whether it is a (preemptible) batch job
+        self._active: Dict[int, bool] = {}
+        self._suspended: Set[int] = set()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+    @property
+    def slots(self) -> int:
+        return self._slots
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stopping = False
+        self.recover()
+        for index in range(self._slots):
+            thread = threading.Thread(target=self._work, name=f"conversion-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="conversion-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        # Running ffmpeg children would otherwise outlive the server; the
+        # interrupted jobs are put back in the queue by their handlers.
+        registry.interrupt_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, preempt: Optional[int] = None) -> None:
+        with self._condition:
+            self._condition.notify()
+            if preempt is None or self._stopping or len(self._active) - len(self._suspended) < self._slots:
+                return
+            victims = [
+                conversion_id
+                for conversion_id, is_batch in self._active.items()
+                if is_batch and conversion_id not in self._suspended
+            ]
+            if not victims:
+                return
+            # The most recently started batch job has the most work left.
+            victim = victims[-1]
+            self._suspended.add(victim)
+        threading.Thread(
+            target=self._preempt, args=(victim, preempt), name="conversion-preempt", daemon=True
+        ).start()
+
+    def recover(self) -> int:
+        # Rows whose owner stopped heartbeating belong to a process that died
+        # mid-encode; live rows of other processes are left alone.
+        stale_before = time.time() - STALE_HEARTBEATS * settings.conversion_heartbeat_seconds
+        db = SessionLocal()
+        try:
+            count = (
+                db.query(Conversion)
+                .filter(
+                    Conversion.status == "processing",
+                    or_(Conversion.heartbeat_at.is_(None), Conversion.heartbeat_at < stale_before),
+                )
+                .update({Conversion.status: "queued", Conversion.progress: 0}, synchronize_session=False)
+            )
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def _claim_next(self, only_id: Optional[int] = None) -> Optional[tuple]:
+        db = SessionLocal()
+        try:
+            query = db.query(Conversion.user_id, func.min(Conversion.id)).filter(Conversion.status == "queued")
+            if only_id is not None:
+                query = query.filter(Conversion.id == only_id)
+            heads = query.group_by(Conversion.user_id).all()
+            with self._condition:
+                candidates = sorted(heads, key=lambda head: (self._running.get(head[0], 0), head[1]))
+            for user_id, conversion_id in candidates:
+                claimed = (
+                    db.query(Conversion)
+                    .filter(Conversion.id == conversion_id, Conversion.status == "queued")
+                    .update(
+                        {Conversion.status: "processing", Conversion.heartbeat_at: time.time()},
+                        synchronize_session=False,
+                    )
+                )
+                db.commit()
+                if claimed:
+                    batch_id = db.query(Conversion.batch_id).filter(Conversion.id == conversion_id).scalar()
+                    with self._condition:
+                        self._running[user_id] = self._running.get(user_id, 0) + 1
+                        self._active[conversion_id] = batch_id is not None
+                    return user_id, conversion_id
+            return None
+        finally:
+            db.close()
+
+    def _run(self, user_id: int, conversion_id: int) -> None:
+        try:
+            with registry.job(conversion_id):
+                self._handler(conversion_id)
+        finally:
+            with self._condition:
+                self._active.pop(conversion_id, None)
+                self._running[user_id] -= 1
+                if not self._running[user_id]:
+                    del self._running[user_id]
+
+    def _preempt(self, victim: int, conversion_id: int) -> None:
+        try:
+            # Only the job that justified the preemption may use the slot; if a
+            # regular worker already took it, there is nothing to do.
+            job = self._claim_next(only_id=conversion_id)
+            if job is None:
+                return
+            # The victim may have finished meanwhile; then a slot is free anyway.
+            suspended = registry.suspend(victim)
+            try:
+                self._run(*job)
+            finally:
+                if suspended:
+                    registry.resume(victim)
+        finally:
+            with self._condition:
+                self._suspended.discard(victim)
+
+    def _beat(self, active: List[int]) -> None:
+        db = SessionLocal()
+        try:
+            db.query(Conversion).filter(Conversion.id.in_(active), Conversion.status == "processing").update(
+                {Conversion.heartbeat_at: time.time()}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _heartbeat(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopping, settings.conversion_heartbeat_seconds)
+                if self._stopping:
+                    return
+                active = list(self._active)
+            try:
+                if active:
+                    self._beat(active)
+                recovered = self.recover()
+            except Exception:
+                # A briefly locked database only delays this beat; the stale
+                # threshold allows for a few missed ones.
+                continue
+            if recovered:
+                with self._condition:
+                    self._condition.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+            job = self._claim_next()
+            if job is None:
+                with self._condition:
+                    if self._stopping:
+                        return
+                    self._condition.wait(settings.conversion_poll_seconds)
+                continue
+            self._run(*job)
@@ -0,0 +1,102 @@
+"""Image conversion throughput: images/sec for the old and new paths.
+
+Generates synthetic JPEG sources and converts each one repeatedly:
+
+* ``4k-thumb``: 3840x2160 -> 320x180 webp
+* ``12mp-1080p``: 4000x3000 -> 1440x1080 jpeg
+
+Modes:
+
+* ``legacy``: the previous in-process path (full-resolution decode, then a
+  single LANCZOS resize), one image at a time.
+* ``draft``: the new ``convert_image`` (JPEG draft decode + reduce), in-process.
+* ``pool``: the new ``convert_image`` fanned out over the image process pool,
+  which is what the API does now.
+
+    python -m benchmarks.image_throughput
+    python -m benchmarks.image_throughput --mode pool --count 64
+
+Uses a throwaway storage directory.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix="vm-bench-")
+os.environ["STORAGE_DIR"] = f"{WORKDIR}/storage"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image as PilImage  # noqa: E402
+
+from app.services import image as image_service  # noqa: E402
+from app.services.storage import IMAGE_CONVERTED_DIR, ensure_storage_dirs  # noqa: E402
+
+CASES = {
+    "4k-thumb": ((3840, 2160), "webp", "320x180"),
+    "12mp-1080p": ((4000, 3000), "jpg", "1440x1080"),
+}
+
+
+def _make_source(name, size):
+    # Noise over a gradient compresses like a photo rather than a flat fill.
+    path = os.path.join(WORKDIR, f"{name}.jpg")
+    noise = PilImage.effect_noise(size, 48)
+    gradient = PilImage.linear_gradient("L").resize(size)
+    PilImage.merge("RGB", (noise, gradient, PilImage.blend(noise, gradient, 0.5))).save(path, quality=90)
+    return path
+
+
+def legacy_convert(input_path, conversion_id, target_format, target_resolution, quality):
+    output_path = IMAGE_CONVERTED_DIR / f"{conversion_id}.{target_format}"
+    with PilImage.open(input_path) as image:
+        width_str, height_str = target_resolution.lower().split("x")
+        image = image.resize((int(width_str), int(height_str)), PilImage.LANCZOS)
+        format_name = "JPEG" if target_format in {"jpg", "jpeg"} else target_format.upper()
+        if format_name == "JPEG":
+            image = image.convert("RGB")
+        image.save(output_path, format=format_name, quality=quality or 85)
+    return str(output_path), None
+
+
+def _run(mode, source, target_format, resolution, count):
+    started = time.perf_counter()
+    if mode == "pool":
+        futures = [
+            image_service.submit_image_job(
+                image_service.convert_image, source, index, target_format, resolution, None
+            )
+            for index in range(count)
+        ]
+        results = [future.result()[0] for future in futures]
+    else:
+        convert = legacy_convert if mode == "legacy" else image_service.convert_image
+        results = [convert(source, index, target_format, resolution, None) for index in range(count)]
+    elapsed = time.perf_counter() - started
+    errors = [error for _path, error in results if error]
+    if errors:
+        raise RuntimeError(errors[0])
+    return count / elapsed
+
+
+def main(args):
+    ensure_storage_dirs()
+    modes = ["legacy", "draft", "pool"] if args.mode == "all" else [args.mode]
+    if "pool" in modes:
+        # Start the workers outside the timed section.
+        image_service.image_pool().submit(os.getpid).result()
+    print(f"workers={image_service.image_worker_count()} count={args.count}")
+    for name, (size, target_format, resolution) in CASES.items():
+        source = _make_source(name, size)
+        for mode in modes:
+            rate = _run(mode, source, target_format, resolution, args.count)
+            print(f"{name:<11} {mode:<7} {rate:8.2f} images/sec")
+    image_service.shutdown_image_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["all", "legacy", "draft", "pool"], default="all")
+    parser.add_argument("--count", type=int, default=16)
+    main(parser.parse_args())
@@ -0,0 +1,141 @@
+"""Login throughput and status-poll latency while logins are running.
+
+Runs the app in-process over httpx's ASGI transport, like a single uvicorn
+worker. It first measures ``GET /api/video/status/{id}`` latency with no
+other load. Then several clients log in back to back for ``--seconds`` while
+the pollers keep polling. The script prints login RPS and p50/p99 poll
+latency for both phases.
+
+``--mode threadpool`` reproduces the old behaviour, with bcrypt running in
+the request threadpool shared with sync endpoints. ``--mode executor``
+uses the dedicated password-hash executor:
+
+    python -m benchmarks.login_throughput --mode threadpool
+    python -m benchmarks.login_throughput --mode executor --logins 16
+
+Cost and concurrency come from ``BCRYPT_ROUNDS`` and ``PASSWORD_HASH_WORKERS``.
+Needs ``httpx`` in addition to the app requirements. Uses a throwaway
+database and storage directory.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix="vm-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR}/bench.db"
+os.environ["STORAGE_DIR"] = f"{WORKDIR}/storage"
+os.environ["RATE_LIMIT_PER_MINUTE"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from fastapi.concurrency import run_in_threadpool  # noqa: E402
+
+from app.core import security  # noqa: E402
+from app.db import models  # noqa: E402,F401
+from app.db.base import Base  # noqa: E402
+from app.db.session import SessionLocal, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models.conversion import Conversion  # noqa: E402
+from app.models.video import Video  # noqa: E402
+from app.services import storage  # noqa: E402
+
+CREDENTIALS = {"username": "bench@example.com", "password": "benchmark1"}
+
+
+async def _threadpool(func, *args):
+    return await run_in_threadpool(func, *args)
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _summary(samples):
+    return (
+        f"polls={len(samples)} p50={statistics.median(samples):.1f}ms "
+        f"p99={_percentile(samples, 0.99):.1f}ms max={max(samples):.1f}ms"
+    )
+
+
+async def _setup(client):
+    await client.post(
+        "/api/auth/register", json={"email": CREDENTIALS["username"], "password": CREDENTIALS["password"]}
+    )
+    response = await client.post("/api/auth/login", data=CREDENTIALS)
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    db = SessionLocal()
+    try:
+        video = Video(user_id=1, original_filename="x.mp4", original_format="mp4", file_size=1, original_path="x")
+        db.add(video)
+        db.commit()
+        conversion = Conversion(video_id=video.id, user_id=1, target_format="mp4", status="completed", progress=100)
+        db.add(conversion)
+        db.commit()
+        return headers, conversion.id
+    finally:
+        db.close()
+
+
+async def _login(client, deadline, counts):
+    while time.perf_counter() < deadline:
+        response = await client.post("/api/auth/login", data=CREDENTIALS)
+        response.raise_for_status()
+        counts.append(1)
+
+
+async def _poll(client, headers, conversion_id, stop, samples):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get(f"/api/video/status/{conversion_id}", headers=headers)
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def _measure(client, headers, conversion_id, pollers, work):
+    stop = asyncio.Event()
+    samples = []
+    tasks = [asyncio.create_task(_poll(client, headers, conversion_id, stop, samples)) for _ in range(pollers)]
+    await work()
+    stop.set()
+    await asyncio.gather(*tasks)
+    return samples
+
+
+async def main(args):
+    if args.mode == "threadpool":
+        security._run_password_job = _threadpool
+    Base.metadata.create_all(bind=engine)
+    storage.ensure_storage_dirs()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        headers, conversion_id = await _setup(client)
+        idle = await _measure(client, headers, conversion_id, args.pollers, lambda: asyncio.sleep(args.seconds))
+        counts = []
+        deadline = time.perf_counter() + args.seconds
+
+        async def logins():
+            await asyncio.gather(*(_login(client, deadline, counts) for _ in range(args.logins)))
+
+        started = time.perf_counter()
+        loaded = await _measure(client, headers, conversion_id, args.pollers, logins)
+        elapsed = time.perf_counter() - started
+    security.shutdown_password_hash_executor()
+    workers = "shared" if args.mode == "threadpool" else security.password_hash_workers()
+    print(f"mode={args.mode} rounds={security.settings.bcrypt_rounds} hash_workers={workers} logins={args.logins}")
+    print(f"login rps={len(counts) / elapsed:.2f} ({len(counts)} in {elapsed:.2f}s)")
+    print(f"status idle   {_summary(idle)}")
+    print(f"status loaded {_summary(loaded)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["executor", "threadpool"], default="executor")
+    parser.add_argument("--logins", type=int, default=8, help="concurrent login clients")
+    parser.add_argument("--pollers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,127 @@
+"""Status-poll latency while large uploads are being written.
+
+Runs the app in-process over httpx's ASGI transport, so everything shares one
+event loop exactly like a single uvicorn worker. Several clients push large
+chunks while others poll ``GET /api/video/status/{id}``; the script prints
+p50/p99 poll latency.
+
+``--mode blocking`` reproduces the old behaviour (file writes on the event
+loop) by running the threadpool jobs inline, for a before/after comparison:
+
+    python -m benchmarks.upload_latency --mode blocking
+    python -m benchmarks.upload_latency --mode threaded
+
+Needs ``httpx`` in addition to the app requirements. Uses a throwaway
+database and storage directory.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix="vm-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR}/bench.db"
+os.environ["STORAGE_DIR"] = f"{WORKDIR}/storage"
+os.environ["RATE_LIMIT_PER_MINUTE"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from app.db import models  # noqa: E402,F401
+from app.db.base import Base  # noqa: E402
+from app.db.session import SessionLocal, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models.conversion import Conversion  # noqa: E402
+from app.models.video import Video  # noqa: E402
+from app.services import storage  # noqa: E402
+
+
+async def _inline(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def _setup(client):
+    await client.post("/api/auth/register", json={"email": "bench@example.com", "password": "benchmark1"})
+    response = await client.post("/api/auth/login", data={"username": "bench@example.com", "password": "benchmark1"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    db = SessionLocal()
+    try:
+        video = Video(user_id=1, original_filename="x.mp4", original_format="mp4", file_size=1, original_path="x")
+        db.add(video)
+        db.commit()
+        conversion = Conversion(video_id=video.id, user_id=1, target_format="mp4", status="completed", progress=100)
+        db.add(conversion)
+        db.commit()
+        return headers, conversion.id
+    finally:
+        db.close()
+
+
+async def _upload(client, headers, size_mb, chunk_mb):
+    total = size_mb * 1024 * 1024
+    chunk = os.urandom(chunk_mb * 1024 * 1024)
+    response = await client.post(
+        "/api/video/upload/init",
+        data={"original_filename": "bench.mp4", "total_size": str(total)},
+        headers=headers,
+    )
+    upload_id = response.json()["upload_id"]
+    for offset in range(0, total, len(chunk)):
+        body = chunk[: total - offset]
+        await client.post(
+            "/api/video/upload/chunk",
+            data={"upload_id": upload_id, "offset": str(offset)},
+            files={"chunk": ("chunk", body)},
+            headers=headers,
+        )
+
+
+async def _poll(client, headers, conversion_id, stop, samples):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get(f"/api/video/status/{conversion_id}", headers=headers)
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def main(args):
+    if args.mode == "blocking":
+        storage.run_in_threadpool = _inline
+    Base.metadata.create_all(bind=engine)
+    storage.ensure_storage_dirs()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        headers, conversion_id = await _setup(client)
+        stop = asyncio.Event()
+        samples = []
+        pollers = [
+            asyncio.create_task(_poll(client, headers, conversion_id, stop, samples)) for _ in range(args.pollers)
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*(_upload(client, headers, args.size_mb, args.chunk_mb) for _ in range(args.uploads)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await asyncio.gather(*pollers)
+    print(f"mode={args.mode} uploads={args.uploads}x{args.size_mb}MiB in {elapsed:.2f}s")
+    print(
+        f"status polls={len(samples)} p50={statistics.median(samples):.1f}ms "
+        f"p99={_percentile(samples, 0.99):.1f}ms max={max(samples):.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["threaded", "blocking"], default="threaded")
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--chunk-mb", type=int, default=32)
+    parser.add_argument("--pollers", type=int, default=8)
+    asyncio.run(main(parser.parse_args()))